@@ -0,0 +1,29 @@
+"""ninth revision: add movie listing index
+
+Revision ID: 2e6d0b4f8a17
+Revises: 7c1e9b3d5a20
+Create Date: 2026-10-18 16:02:41.215630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e6d0b4f8a17'
+down_revision = '7c1e9b3d5a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keyset pagination of engine listings on (date_created, id)
+    op.create_index(
+        'ix_movies_engine_date_created',
+        'movies',
+        [sa.text('lower(engine)'), 'date_created', 'id'],
+    )
+
+
+def downgrade():
+    op.drop_index('ix_movies_engine_date_created', table_name='movies')
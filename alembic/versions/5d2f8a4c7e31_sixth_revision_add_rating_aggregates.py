@@ -0,0 +1,40 @@
+"""sixth revision: add rating aggregates to movies
+
+Revision ID: 5d2f8a4c7e31
+Revises: c4034c570dba
+Create Date: 2026-10-18 13:40:12.512034
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2f8a4c7e31'
+down_revision = 'c4034c570dba'
+branch_labels = None
+depends_on = None
+
+# number of movies backfilled per UPDATE
+BACKFILL_BATCH_SIZE = 1000
+
+
+def upgrade():
+    op.add_column('movies', sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('movies', sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False))
+
+    connection = op.get_bind()
+    max_id = connection.execute(sa.text('SELECT max(id) FROM movies')).scalar() or 0
+    backfill = sa.text(
+        'UPDATE movies SET '
+        'rating_sum = (SELECT coalesce(sum(score), 0) FROM ratings WHERE ratings.movie_id = movies.id), '
+        'rating_count = (SELECT count(*) FROM ratings WHERE ratings.movie_id = movies.id) '
+        'WHERE id >= :start AND id < :end'
+    )
+    for start in range(0, max_id + 1, BACKFILL_BATCH_SIZE):
+        connection.execute(backfill, {'start': start, 'end': start + BACKFILL_BATCH_SIZE})
+
+
+def downgrade():
+    op.drop_column('movies', 'rating_count')
+    op.drop_column('movies', 'rating_sum')
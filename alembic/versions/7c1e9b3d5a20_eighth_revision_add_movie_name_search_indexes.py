@@ -0,0 +1,56 @@
+"""eighth revision: add movie name search indexes
+
+Revision ID: 7c1e9b3d5a20
+Revises: b058fc2fb359
+Create Date: 2026-10-18 14:51:05.733918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e9b3d5a20'
+down_revision = 'b058fc2fb359'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_movies_name_trgm ON movies USING gin (name gin_trgm_ops)')
+    elif dialect == 'sqlite':
+        # the trigram tokenizer needs SQLite >= 3.34
+        op.execute(
+            "CREATE VIRTUAL TABLE movies_fts USING fts5("
+            "name, content='movies', content_rowid='id', tokenize='trigram')"
+        )
+        op.execute(
+            "CREATE TRIGGER movies_fts_insert AFTER INSERT ON movies BEGIN "
+            "INSERT INTO movies_fts (rowid, name) VALUES (new.id, new.name); END"
+        )
+        op.execute(
+            "CREATE TRIGGER movies_fts_delete AFTER DELETE ON movies BEGIN "
+            "INSERT INTO movies_fts (movies_fts, rowid, name) "
+            "VALUES ('delete', old.id, old.name); END"
+        )
+        op.execute(
+            "CREATE TRIGGER movies_fts_update AFTER UPDATE OF name ON movies BEGIN "
+            "INSERT INTO movies_fts (movies_fts, rowid, name) "
+            "VALUES ('delete', old.id, old.name); "
+            "INSERT INTO movies_fts (rowid, name) VALUES (new.id, new.name); END"
+        )
+        op.execute("INSERT INTO movies_fts (movies_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX ix_movies_name_trgm')
+    elif dialect == 'sqlite':
+        op.execute('DROP TRIGGER movies_fts_update')
+        op.execute('DROP TRIGGER movies_fts_delete')
+        op.execute('DROP TRIGGER movies_fts_insert')
+        op.execute('DROP TABLE movies_fts')
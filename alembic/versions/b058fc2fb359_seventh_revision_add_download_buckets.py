@@ -0,0 +1,46 @@
+"""seventh revision: add hourly download buckets
+
+Revision ID: b058fc2fb359
+Revises: 5d2f8a4c7e31
+Create Date: 2026-10-18 14:02:47.190361
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b058fc2fb359'
+down_revision = '5d2f8a4c7e31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('download_buckets',
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['movie_id'], ['movies.id'], ),
+    sa.PrimaryKeyConstraint('movie_id', 'bucket_start')
+    )
+    op.create_index(op.f('ix_download_buckets_bucket_start'), 'download_buckets', ['bucket_start'], unique=False)
+
+    # roll the existing downloads up into their buckets
+    connection = op.get_bind()
+    if connection.dialect.name == 'postgresql':
+        hour = "date_trunc('hour', datetime)"
+    else:
+        # same text format SQLAlchemy stores sqlite datetimes in
+        hour = "strftime('%Y-%m-%d %H:00:00.000000', datetime)"
+    connection.execute(sa.text(
+        f'INSERT INTO download_buckets (movie_id, bucket_start, count) '
+        f'SELECT movie_id, {hour}, count(*) FROM downloads '
+        f'WHERE movie_id IS NOT NULL AND datetime IS NOT NULL '
+        f'GROUP BY movie_id, {hour}'
+    ))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_download_buckets_bucket_start'), table_name='download_buckets')
+    op.drop_table('download_buckets')
@@ -0,0 +1,40 @@
+"""tenth revision: add lookup indexes
+
+Revision ID: f31a9c5e7b62
+Revises: 2e6d0b4f8a17
+Create Date: 2026-10-18 16:48:19.604318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f31a9c5e7b62'
+down_revision = '2e6d0b4f8a17'
+branch_labels = None
+depends_on = None
+
+# ratings.movie_id is covered by the (movie_id, ip_address) unique constraint
+# and lower(engine), date_created by ix_movies_engine_date_created
+INDEXES = (
+    ('ix_movies_referral_id', 'movies', ['referral_id'], True),
+    ('ix_downloads_movie_id_datetime', 'downloads', ['movie_id', 'datetime'], False),
+    ('ix_referrals_movie_id_datetime', 'referrals', ['movie_id', 'datetime'], False),
+)
+
+
+def upgrade():
+    # CONCURRENTLY does not lock out writes on PostgreSQL but cannot run
+    # inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(
+                name, table, columns, unique=unique, postgresql_concurrently=True
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -1,8 +1,11 @@
+import asyncio
+import logging
 from typing import List
 from fastapi import FastAPI
 
 # from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
 from app.settings import (
     settings,
@@ -10,12 +13,50 @@ from app.settings import (
 from app import models
 from app.models import SessionLocal, engine
 from app.routers import router
+from app import fuzzy, metrics, resolver, utils, trending, writebehind
 
 
 app = FastAPI()
 
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(router)
 
+
+background_tasks = []
+
+
+@app.on_event("startup")
+async def startup():
+    """Open the pooled Gophie client and start background jobs once per worker"""
+    utils.get_gophie_client()
+    background_tasks.append(asyncio.ensure_future(warm_resolver()))
+    if settings.trending_enabled:
+        background_tasks.append(asyncio.ensure_future(trending.resync_forever()))
+    if settings.write_behind_enabled:
+        writebehind.buffer.start()
+    if settings.fuzzy_index_enabled:
+        background_tasks.append(asyncio.ensure_future(fuzzy.resync_forever()))
+
+
+async def warm_resolver():
+    try:
+        await run_in_threadpool(resolver.warm)
+    except Exception:
+        logging.exception("Could not warm the referral resolver")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    # flush buffered events before the worker exits
+    await run_in_threadpool(writebehind.buffer.stop)
+    await utils.close_gophie_client()
+    if settings.async_database:
+        # aiosqlite connections keep a thread each until they are closed
+        await models.async_engine.dispose()
+
 # keeps clashing with alembic for table creation
 # Uncomment to use poor man's table creation
 # models.Base.metadata.create_all(bind=engine)
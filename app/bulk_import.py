@@ -0,0 +1,220 @@
+"""
+Bulk import of historical downloads, referrals and ratings
+
+    python -m app.bulk_import downloads downloads.csv more_downloads.ndjson
+
+Files are CSV with a header row or NDJSON (.ndjson, .jsonl) with a
+referral_id and ip_address per event, plus a datetime for downloads and
+referrals or a score for ratings. Each batch is resolved, loaded and
+applied to the aggregate tables in one transaction
+"""
+import io
+import csv
+import sys
+import json
+import time
+import argparse
+import datetime
+import itertools
+import collections
+from typing import Dict, Iterable, List
+
+from sqlalchemy import bindparam, tuple_
+from sqlalchemy.orm import Session
+
+from app import resolver
+from app.models import SessionLocal, crud, models
+from app.models.utils import download_bucket_start
+
+BATCH_SIZE = 10000
+
+
+def read_rows(path: str):
+    """Yields the rows of a CSV or NDJSON file as dicts"""
+    with open(path, newline="") as file:
+        if path.endswith((".ndjson", ".jsonl")):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def batches(rows: Iterable[dict], size: int):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def parse_datetime(value):
+    """ISO 8601 datetimes, naive UTC like the rest of the tables"""
+    moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def copy_events(db: Session, table, rows: List[dict]):
+    """
+    Inserts downloads or referrals, with COPY on PostgreSQL and executemany
+    elsewhere
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        db.execute(table.insert(), rows)
+        return
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        (row["movie_id"], row["ip_address"], row["datetime"].isoformat())
+        for row in rows
+    )
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} (movie_id, ip_address, datetime) FROM STDIN WITH CSV",
+        buffer,
+    )
+
+
+def import_downloads(db: Session, rows: List[dict]):
+    copy_events(db, models.Download.__table__, rows)
+    crud.increment_download_buckets(
+        db,
+        collections.Counter(
+            (row["movie_id"], download_bucket_start(row["datetime"])) for row in rows
+        ),
+    )
+
+
+def import_referrals(db: Session, rows: List[dict]):
+    copy_events(db, models.Referral.__table__, rows)
+
+
+def import_ratings(db: Session, rows: List[dict]):
+    """
+    Upserts ratings, the last one of an ip address wins, and applies the
+    score changes to the movies' rating aggregates
+    """
+    latest = {(row["movie_id"], row["ip_address"]): row for row in rows}
+    keys = list(latest)
+    old_scores = {}
+    for start in range(0, len(keys), resolver.LOOKUP_CHUNK):
+        chunk = keys[start : start + resolver.LOOKUP_CHUNK]
+        old_scores.update(
+            ((movie_id, ip_address), score)
+            for movie_id, ip_address, score in db.query(
+                models.Rating.movie_id, models.Rating.ip_address, models.Rating.score
+            )
+            .filter(
+                tuple_(models.Rating.movie_id, models.Rating.ip_address).in_(chunk)
+            )
+            .with_for_update()
+        )
+
+    table = models.Rating.__table__
+    stmt = crud.dialect_insert(db, table)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["movie_id", "ip_address"],
+            set_={"score": stmt.excluded.score},
+        ),
+        list(latest.values()),
+    )
+
+    deltas = collections.defaultdict(lambda: [0, 0])
+    for key, row in latest.items():
+        delta = deltas[row["movie_id"]]
+        if key in old_scores:
+            delta[0] += row["score"] - old_scores[key]
+        else:
+            delta[0] += row["score"]
+            delta[1] += 1
+    movies = models.Movie.__table__
+    db.execute(
+        movies.update()
+        .where(movies.c.id == bindparam("movie"))
+        .values(
+            rating_sum=movies.c.rating_sum + bindparam("sum_delta"),
+            rating_count=movies.c.rating_count + bindparam("count_delta"),
+        ),
+        [
+            {"movie": movie_id, "sum_delta": sum_delta, "count_delta": count_delta}
+            for movie_id, (sum_delta, count_delta) in deltas.items()
+        ],
+    )
+
+
+IMPORTERS = {
+    "downloads": import_downloads,
+    "referrals": import_referrals,
+    "ratings": import_ratings,
+}
+
+
+def event_row(kind: str, movie_id: int, raw: Dict[str, str]):
+    row = {"movie_id": movie_id, "ip_address": raw["ip_address"]}
+    if kind == "ratings":
+        row["score"] = int(raw["score"])
+    else:
+        row["datetime"] = parse_datetime(raw["datetime"])
+    return row
+
+
+def import_batch(db: Session, kind: str, raw_rows: List[dict]):
+    """
+    Imports a batch of raw rows in one transaction, returns the number of
+    rows imported and skipped for an unknown referral id
+    """
+    movies = resolver.resolve_many(db, (raw["referral_id"] for raw in raw_rows))
+    rows = [
+        event_row(kind, movies[raw["referral_id"]].id, raw)
+        for raw in raw_rows
+        if raw["referral_id"] in movies
+    ]
+    if rows:
+        IMPORTERS[kind](db, rows)
+    db.commit()
+    return len(rows), len(raw_rows) - len(rows)
+
+
+def import_files(db: Session, kind: str, paths: List[str], batch_size: int):
+    imported = skipped = 0
+    start = time.monotonic()
+    for path in paths:
+        for batch in batches(read_rows(path), batch_size):
+            batch_imported, batch_skipped = import_batch(db, kind, batch)
+            imported += batch_imported
+            skipped += batch_skipped
+            elapsed = time.monotonic() - start
+            print(
+                f"{path}: {imported} {kind} imported, {skipped} skipped, "
+                f"{imported / max(elapsed, 1e-9):.0f} rows/sec",
+                file=sys.stderr,
+            )
+    return imported, skipped, time.monotonic() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("kind", choices=IMPORTERS)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        imported, skipped, elapsed = import_files(
+            db, args.kind, args.files, args.batch_size
+        )
+    finally:
+        db.close()
+    print(
+        f"Imported {imported} {args.kind} ({skipped} skipped for unknown referral "
+        f"ids) in {elapsed:.1f}s, {imported / max(elapsed, 1e-9):.0f} rows/sec"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+In-process caches with per function TTLs, LRU eviction and invalidation hooks
+"""
+import time
+import asyncio
+import logging
+import functools
+import threading
+import collections
+from typing import Callable, Dict, List
+
+from app.settings import settings
+
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    A size bounded LRU mapping whose entries expire `ttl` seconds after they
+    are stored
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=_missing):
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is not _missing and entry[0] <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                entry = _missing
+            if entry is _missing:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        """Stores a value for `ttl` seconds, the cache's ttl by default"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable):
+        """Drops every key for which predicate(key) is true"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+        }
+
+
+class StaleCache(TTLCache):
+    """
+    TTLCache of (fresh_until, value) entries, values are served after
+    fresh_until until they expire, see stale_while_revalidate
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int):
+        super().__init__(name, ttl, maxsize)
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.coalesced = 0
+
+    def postpone(self, key, seconds: float):
+        """Keeps serving a stale entry for `seconds` before refreshing it again"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, (_, value) = entry
+                self._data[key] = (expires_at, (time.monotonic() + seconds, value))
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "stale_hits": self.stale_hits,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "coalesced": self.coalesced,
+        }
+
+
+_caches: Dict[str, TTLCache] = {}
+_hooks: Dict[str, List[Callable]] = collections.defaultdict(list)
+
+
+def named_cache(name: str, cache_class=TTLCache):
+    """
+    Creates a TTLCache sized from settings.cache_ttls and
+    settings.cache_maxsizes, included in stats() and clear_all()
+    """
+    cache = cache_class(
+        name,
+        ttl=settings.cache_ttls.get(name, settings.cache_default_ttl),
+        maxsize=settings.cache_maxsizes.get(name, settings.cache_default_maxsize),
+    )
+    _caches[name] = cache
+    return cache
+
+
+def cached(name: str, key: Callable):
+    """
+    Caches the results of a function or coroutine function in a TTLCache.
+    `key` is called with the function's arguments and must return a hashable
+    key built from them, see named_cache. None results are not cached, as
+    what is missing now may be created by another worker at any time
+    """
+
+    def decorator(func):
+        cache = named_cache(name)
+
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                cache_key = key(*args, **kwargs)
+                value = cache.get(cache_key)
+                if value is _missing:
+                    value = await func(*args, **kwargs)
+                    if value is not None:
+                        cache.set(cache_key, value)
+                return value
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                cache_key = key(*args, **kwargs)
+                value = cache.get(cache_key)
+                if value is _missing:
+                    value = func(*args, **kwargs)
+                    if value is not None:
+                        cache.set(cache_key, value)
+                return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def stale_while_revalidate(
+    name: str,
+    key: Callable,
+    ttls: Callable,
+    retry_after: float,
+):
+    """
+    Caches the results of a coroutine function in a StaleCache. `ttls` is
+    called with the function's arguments and returns the (soft, hard) TTLs
+    of the result. Past the soft TTL the result is served stale while
+    another call of the function replaces it in a background task, one per
+    key. A failed refresh keeps the stale result
+    for `retry_after` seconds more, only results past their hard TTL are
+    recomputed by the caller. Concurrent misses of a key share one call of
+    the function and its result or error, so the function must not use
+    resources of its callers such as their database sessions
+    """
+
+    def decorator(func):
+        cache = named_cache(name, StaleCache)
+        refreshing: Dict[object, asyncio.Task] = {}
+        loading: Dict[object, asyncio.Task] = {}
+
+        def store(cache_key, value, args, kwargs):
+            soft, hard = ttls(*args, **kwargs)
+            cache.set(cache_key, (time.monotonic() + soft, value), ttl=hard)
+
+        async def revalidate(cache_key, args, kwargs):
+            try:
+                store(cache_key, await func(*args, **kwargs), args, kwargs)
+                cache.refreshes += 1
+            except Exception as e:
+                cache.refresh_failures += 1
+                cache.postpone(cache_key, retry_after)
+                logging.warning(f"Could not refresh {name} {cache_key}: {e}")
+            finally:
+                refreshing.pop(cache_key, None)
+
+        async def load(cache_key, args, kwargs):
+            try:
+                value = await func(*args, **kwargs)
+                store(cache_key, value, args, kwargs)
+                return value
+            finally:
+                loading.pop(cache_key, None)
+
+        def running(tasks: Dict[object, asyncio.Task], cache_key):
+            task = tasks.get(cache_key)
+            # tasks of a closed event loop never finish
+            if task is None or task.get_loop() is not asyncio.get_running_loop():
+                return None
+            return task
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            entry = cache.get(cache_key)
+            if entry is _missing:
+                task = running(loading, cache_key)
+                if task is None:
+                    task = loading[cache_key] = asyncio.ensure_future(
+                        load(cache_key, args, kwargs)
+                    )
+                else:
+                    cache.coalesced += 1
+                # a cancelled caller leaves the call running for the others
+                return await asyncio.shield(task)
+            fresh_until, value = entry
+            if fresh_until <= time.monotonic():
+                cache.stale_hits += 1
+                if running(refreshing, cache_key) is None:
+                    refreshing[cache_key] = asyncio.ensure_future(
+                        revalidate(cache_key, args, kwargs)
+                    )
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def on(event: str):
+    """Registers the decorated function as an invalidation hook for an event"""
+
+    def decorator(func):
+        _hooks[event].append(func)
+        return func
+
+    return decorator
+
+
+def fire(event: str, **payload):
+    """Calls every hook registered for an event, hooks must not break writes"""
+    for hook in _hooks[event]:
+        try:
+            hook(**payload)
+        except Exception:
+            logging.exception(f"Cache hook {hook.__name__} failed for {event}")
+
+
+def stats():
+    """Returns hit/miss/eviction stats of every cache"""
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def clear_all():
+    for cache in _caches.values():
+        cache.clear()
@@ -0,0 +1,127 @@
+"""
+Per engine circuit breakers of Gophie requests
+"""
+import time
+import logging
+from typing import Dict, Optional
+
+from app.settings import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed or slower than
+    `slow_seconds` calls and rejects calls for `open_seconds`. It then lets
+    `probes` calls through at once, the first result closes or reopens it.
+    Each state change starts a new generation, outcomes of calls allowed in
+    an earlier one are ignored unless the circuit is closed. Used from the
+    event loop only
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        slow_seconds: float,
+        open_seconds: float,
+        probes: int,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = 0
+        self.generation = 0
+
+    def transition(self, state: str):
+        self.state = state
+        self.generation += 1
+
+    def allow(self) -> Optional[int]:
+        """
+        The generation a call is allowed in, or None if it may not be made.
+        Every allowed call must be recorded with its generation
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return None
+            self.transition(HALF_OPEN)
+            self._probing = 0
+        if self.state == HALF_OPEN:
+            if self._probing >= self.probes:
+                self.rejected += 1
+                return None
+            self._probing += 1
+        return self.generation
+
+    def record(self, generation: int, ok: bool, elapsed: float):
+        """Records the outcome of a call allowed in `generation`"""
+        if generation != self.generation and self.state != CLOSED:
+            # allowed before the circuit last opened or started probing, it
+            # says nothing about whether the engine recovered
+            return
+        if self.state == HALF_OPEN:
+            self._probing -= 1
+        if ok and elapsed <= self.slow_seconds:
+            self.failures = 0
+            if self.state == HALF_OPEN:
+                self.transition(CLOSED)
+                logging.info(f"Circuit of {self.name} closed")
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.trip()
+
+    def trip(self):
+        if self.state != OPEN:
+            self.opened += 1
+            logging.warning(
+                f"Circuit of {self.name} opened after {self.failures} failures"
+            )
+        self.transition(OPEN)
+        self._opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker(engine: str):
+    """The circuit breaker of an engine's Gophie requests"""
+    key = engine.lower()
+    if key not in _breakers:
+        _breakers[key] = CircuitBreaker(
+            key,
+            failure_threshold=settings.gophie_breaker_failures,
+            slow_seconds=settings.gophie_breaker_slow_seconds,
+            open_seconds=settings.gophie_breaker_open_seconds,
+            probes=settings.gophie_breaker_probes,
+        )
+    return _breakers[key]
+
+
+def stats():
+    """Returns the state of every engine's circuit breaker"""
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+def reset():
+    _breakers.clear()
@@ -0,0 +1,112 @@
+"""
+Streaming exports of ratings, downloads and referrals as NDJSON or CSV
+
+    python -m app.export downloads --format csv --since 2020-01-01 -o out.csv
+"""
+import io
+import csv
+import sys
+import json
+import argparse
+import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.settings import settings
+from app.models import SessionLocal, models
+
+EVENTS = {
+    "ratings": models.Rating,
+    "downloads": models.Download,
+    "referrals": models.Referral,
+}
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def query_events(
+    db: Session,
+    kind: str,
+    engine: str = None,
+    since: datetime.datetime = None,
+    until: datetime.datetime = None,
+):
+    """
+    Events of a kind with their movie's referral id and engine, read through
+    a server-side cursor in batches of settings.export_batch_size
+    """
+    event = EVENTS[kind]
+    if event is models.Rating:
+        if since or until:
+            raise ValueError("Ratings cannot be filtered by time")
+        detail = event.score
+    else:
+        detail = event.datetime
+    query = db.query(
+        event.id,
+        event.movie_id,
+        models.Movie.referral_id,
+        models.Movie.engine,
+        event.ip_address,
+        detail,
+    ).join(models.Movie, models.Movie.id == event.movie_id)
+    if engine:
+        query = query.filter(func.lower(models.Movie.engine) == engine.lower())
+    if since:
+        query = query.filter(event.datetime >= since)
+    if until:
+        query = query.filter(event.datetime < until)
+    return query.order_by(event.id).yield_per(settings.export_batch_size)
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def stream(query, format: str = "ndjson"):
+    """Yields the rows of an events query as text, one chunk per batch"""
+    columns = [column["name"] for column in query.column_descriptions]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if format == "csv":
+        writer.writerow(columns)
+    for number, row in enumerate(query, 1):
+        values = [export_value(value) for value in row]
+        if format == "csv":
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values))) + "\n")
+        if number % settings.export_batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("kind", choices=EVENTS)
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--engine")
+    parser.add_argument("--since", type=datetime.datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.datetime.fromisoformat)
+    parser.add_argument("-o", "--output", help="file to write, stdout by default")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        query = query_events(db, args.kind, args.engine, args.since, args.until)
+        for chunk in stream(query, args.format):
+            output.write(chunk)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
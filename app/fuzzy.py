@@ -0,0 +1,224 @@
+"""
+In-process trigram index over movie names for fuzzy partial ratio search
+"""
+import re
+import math
+import asyncio
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, Optional
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app import cache
+from app.settings import settings
+from app.models import SessionLocal, models
+
+_non_alphanumeric = re.compile(r"[\W_]+")
+
+
+def trigrams(text: str):
+    """Distinct character trigrams of a name, words are padded by spaces"""
+    normalized = " " + _non_alphanumeric.sub(" ", text.lower()).strip() + " "
+    return {normalized[i : i + 3] for i in range(len(normalized) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted index from trigrams to document slots. Posting lists are
+    `array`s of slots and documents are stored as parallel arrays, a
+    renamed movie gets a new slot and its old one is tombstoned
+    """
+
+    def __init__(self):
+        # per slot
+        self.movie_ids = array("q")
+        self.name_hashes = array("q")
+        self.gram_counts = array("H")
+        self.alive = bytearray()
+        # movie ids added in ascending order and their slots, for bisecting
+        self.ordered_ids = array("q")
+        self.ordered_slots = array("I")
+        # slots of renamed or out of order movies, normally small
+        self.moved: Dict[int, int] = {}
+        self.postings: Dict[str, array] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def slot_of(self, movie_id: int):
+        if movie_id in self.moved:
+            return self.moved[movie_id]
+        position = bisect_left(self.ordered_ids, movie_id)
+        if (
+            position < len(self.ordered_ids)
+            and self.ordered_ids[position] == movie_id
+        ):
+            return self.ordered_slots[position]
+        return None
+
+    def add(self, movie_id: int, name: str):
+        with self._lock:
+            slot = self.slot_of(movie_id)
+            if slot is not None:
+                if self.name_hashes[slot] == hash(name):
+                    return
+                self.alive[slot] = 0
+            new_slot = len(self.movie_ids)
+            if slot is None and (
+                not self.ordered_ids or movie_id > self.ordered_ids[-1]
+            ):
+                self.ordered_ids.append(movie_id)
+                self.ordered_slots.append(new_slot)
+            else:
+                self.moved[movie_id] = new_slot
+            grams = trigrams(name)
+            self.movie_ids.append(movie_id)
+            self.name_hashes.append(hash(name))
+            self.gram_counts.append(min(len(grams), 0xFFFF))
+            self.alive.append(1)
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = array("I")
+                posting.append(new_slot)
+
+    def search(self, query: str, limit: int, offset: int = 0, after=None):
+        """
+        Returns up to `limit` (rank, movie_id) pairs, best first. Names are
+        ranked by the number of the query's trigrams they contain (partial
+        ratio), ties go to the name with the higher Jaccard similarity.
+        Results start after the (rank, movie_id) keyset `after` if given
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+        min_shared = max(1, math.ceil(len(grams) * settings.fuzzy_min_similarity))
+        wanted = offset + limit
+        with self._lock:
+            # zero-copy views, they must not outlive the lock because the
+            # arrays cannot grow while a buffer is exported
+            postings = [
+                np.frombuffer(self.postings[gram], dtype=np.uint32)
+                for gram in grams
+                if gram in self.postings
+            ]
+            if not postings:
+                return []
+            slots, shared = np.unique(np.concatenate(postings), return_counts=True)
+            del postings
+            matched = shared >= min_shared
+            slots, shared = slots[matched], shared[matched]
+            alive = np.frombuffer(self.alive, dtype=np.uint8)[slots].astype(bool)
+            slots, shared = slots[alive], shared[alive]
+            gram_counts = np.frombuffer(self.gram_counts, dtype=np.uint16)[slots]
+            movie_ids = np.frombuffer(self.movie_ids, dtype=np.int64)[slots]
+            del alive
+        jaccard = shared / (len(grams) + gram_counts - shared)
+        # shared trigrams first and Jaccard similarity for ties, as Jaccard
+        # is at most 1 the sum ranks both at once
+        rank = shared + jaccard
+        if after is not None:
+            last_rank, last_id = after
+            later = (rank < last_rank) | ((rank == last_rank) & (movie_ids > last_id))
+            rank, movie_ids = rank[later], movie_ids[later]
+        if len(rank) > wanted:
+            best = np.argpartition(-rank, wanted - 1)[:wanted]
+            rank, movie_ids = rank[best], movie_ids[best]
+        order = np.lexsort((movie_ids, -rank))[offset:wanted]
+        return [(float(rank[i]), int(movie_ids[i])) for i in order]
+
+
+class FuzzyIndex:
+    """
+    One trigram index per engine, built from the movies table and kept up
+    to date by loading the movies created since the last load
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.engines: Dict[str, TrigramIndex] = {}
+        # highest movie id loaded from the table
+        self.max_id = 0
+        # movies saved while the index is first built
+        self._pending: Optional[list] = None
+        self._lock = threading.Lock()
+
+    def add(self, movie_id: int, engine: str, name: str):
+        if not (engine and name):
+            return
+        key = engine.lower()
+        if key not in self.engines:
+            self.engines[key] = TrigramIndex()
+        self.engines[key].add(movie_id, name)
+
+    def add_saved(self, movies):
+        """Adds saved movies, they are kept until the first load finishes"""
+        with self._lock:
+            if not self.ready:
+                if self._pending is not None:
+                    self._pending.extend(movies)
+                return
+        for movie in movies:
+            self.add(movie.id, movie.engine, movie.name)
+
+    def search(
+        self, engine: str, query: str, limit: int, offset: int = 0, after=None
+    ):
+        index = self.engines.get(engine.lower())
+        return index.search(query, limit, offset, after) if index else []
+
+    def load(self, db):
+        """Adds the movies created since the last load"""
+        with self._lock:
+            if not self.ready and self._pending is None:
+                self._pending = []
+        rows = (
+            db.query(models.Movie.id, models.Movie.engine, models.Movie.name)
+            .filter(models.Movie.id > self.max_id)
+            .order_by(models.Movie.id)
+            .yield_per(10000)
+        )
+        for movie_id, engine, name in rows:
+            self.add(movie_id, engine, name)
+            self.max_id = movie_id
+        with self._lock:
+            pending, self._pending = self._pending or [], None
+            for movie in pending:
+                self.add(movie.id, movie.engine, movie.name)
+            self.ready = True
+
+
+index = FuzzyIndex()
+
+
+def build():
+    """Builds the fuzzy index from the movies table, or updates it"""
+    db = SessionLocal()
+    try:
+        index.load(db)
+        logging.info(f"Fuzzy index loaded up to movie {index.max_id}")
+    finally:
+        db.close()
+
+
+async def resync_forever():
+    """
+    Builds the index then loads new movies periodically so movies saved by
+    other workers are picked up
+    """
+    while True:
+        try:
+            await run_in_threadpool(build)
+        except Exception:
+            logging.exception("Could not load the fuzzy search index")
+        await asyncio.sleep(settings.fuzzy_resync_seconds)
+
+
+@cache.on("movies_saved")
+def index_saved_movies(movies):
+    index.add_saved(movies)
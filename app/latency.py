@@ -0,0 +1,95 @@
+"""
+Rolling latencies of each engine's Gophie responses, and the timeouts and
+hedging delays derived from them
+"""
+import math
+import collections
+from typing import Dict, Optional
+
+from app.settings import settings
+
+
+class LatencyTracker:
+    """
+    The latest `window` response times of an engine. Percentiles are None
+    until `min_samples` are recorded
+    """
+
+    def __init__(self, window: int, min_samples: int):
+        self.min_samples = min_samples
+        self.samples = collections.deque(maxlen=window)
+        self._sorted = None
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self._sorted = None
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self.samples)
+        rank = max(math.ceil(percent / 100 * len(self._sorted)) - 1, 0)
+        return self._sorted[rank]
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+
+
+def tracker(engine: str):
+    """The latency tracker of an engine"""
+    key = engine.lower()
+    if key not in _trackers:
+        _trackers[key] = LatencyTracker(
+            settings.gophie_latency_window, settings.gophie_latency_min_samples
+        )
+    return _trackers[key]
+
+
+def timeout(engine: str):
+    """
+    Seconds to wait for an engine, its p99 latency times
+    gophie_timeout_multiplier within gophie_min_timeout and the engine's
+    fixed timeout, which is used until enough latencies are recorded
+    """
+    key = engine.lower()
+    ceiling = settings.gophie_timeouts.get(key, settings.gophie_timeout)
+    if not settings.gophie_adaptive_timeouts.get(
+        key, settings.gophie_adaptive_timeout
+    ):
+        return ceiling
+    p99 = tracker(key).percentile(99)
+    if p99 is None:
+        return ceiling
+    adaptive = p99 * settings.gophie_timeout_multiplier
+    return min(max(adaptive, settings.gophie_min_timeout), ceiling)
+
+
+def hedge_delay(engine: str):
+    """
+    Seconds after which a second request is sent to an engine, None when the
+    engine is not hedged or too few latencies are recorded
+    """
+    key = engine.lower()
+    if not settings.gophie_hedges.get(key, settings.gophie_hedge):
+        return None
+    return tracker(key).percentile(settings.gophie_hedge_percentile)
+
+
+def stats():
+    """Returns the latency percentiles, timeout and hedge delay of every engine"""
+    return {
+        engine: {
+            "samples": len(engine_tracker.samples),
+            "p50": engine_tracker.percentile(50),
+            "p95": engine_tracker.percentile(95),
+            "p99": engine_tracker.percentile(99),
+            "timeout": timeout(engine),
+            "hedge_delay": hedge_delay(engine),
+        }
+        for engine, engine_tracker in _trackers.items()
+    }
+
+
+def reset():
+    _trackers.clear()
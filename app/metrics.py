@@ -0,0 +1,280 @@
+"""
+Request, upstream, database and cache metrics in the Prometheus text format
+"""
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import cache, circuit, latency
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+_metrics: List["Metric"] = []
+# statements executed by the current request, see MetricsMiddleware
+_queries = contextvars.ContextVar("queries", default=None)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra: str = ""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A metric family, samples are keyed by their label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def key(self, labels: dict):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """(name suffix, label values, extra label, value) of every sample"""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", key, "", value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            labels = format_labels(self.labels, key, extra)
+            lines.append(f"{self.name}{suffix}{labels} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Observations counted in cumulative `le` buckets, with their sum"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket and +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                yield "_bucket", key, f'le="{bound}"', total
+            yield "_sum", key, "", counts[-1]
+            yield "_count", key, "", total
+
+
+requests_in_flight = Gauge(
+    "ocena_http_requests_in_flight", "Requests being served by this worker"
+)
+request_latency = Histogram(
+    "ocena_http_request_duration_seconds",
+    "Latency of requests by route",
+    labels=("method", "route", "status"),
+)
+request_queries = Histogram(
+    "ocena_http_request_db_queries",
+    "Database statements executed per request",
+    labels=("method", "route"),
+    buckets=QUERY_BUCKETS,
+)
+gophie_latency = Histogram(
+    "ocena_gophie_request_duration_seconds",
+    "Latency of Gophie requests by engine and status",
+    labels=("engine", "status"),
+)
+gophie_hedges = Counter(
+    "ocena_gophie_hedged_requests_total",
+    "Second requests sent to engines slower than their hedge delay",
+    labels=("engine",),
+)
+
+# cache stats exported as counters, the rest are gauges
+CACHE_COUNTERS = (
+    "hits",
+    "misses",
+    "evictions",
+    "expirations",
+    "stale_hits",
+    "refreshes",
+    "refresh_failures",
+    "coalesced",
+)
+CACHE_GAUGES = ("size", "maxsize")
+
+
+def render_caches():
+    """Stats of every cache, stale-while-revalidate stats of those having them"""
+    stats = sorted(cache.stats().items())
+    lines = []
+    for field in CACHE_COUNTERS + CACHE_GAUGES:
+        kind = "counter" if field in CACHE_COUNTERS else "gauge"
+        name = f"ocena_cache_{field}" + ("_total" if kind == "counter" else "")
+        help = field.replace("_", " ").capitalize()
+        lines.append(f"# HELP {name} {help} of each in-process cache")
+        lines.append(f"# TYPE {name} {kind}")
+        for cache_name, cache_stats in stats:
+            if field in cache_stats:
+                labels = format_labels(("cache",), (cache_name,))
+                lines.append(f"{name}{labels} {cache_stats[field]}")
+    return lines
+
+
+# gauge values of the circuit states
+CIRCUIT_STATES = {circuit.CLOSED: 0, circuit.HALF_OPEN: 1, circuit.OPEN: 2}
+
+
+def render_circuits():
+    """State, openings and rejected requests of each engine's circuit"""
+    stats = sorted(circuit.stats().items())
+    lines = [
+        "# HELP ocena_gophie_circuit_state "
+        "Circuit of each engine, 0 closed, 1 half open and 2 open",
+        "# TYPE ocena_gophie_circuit_state gauge",
+    ]
+    for engine, engine_stats in stats:
+        labels = format_labels(("engine",), (engine,))
+        state = CIRCUIT_STATES[engine_stats["state"]]
+        lines.append(f"ocena_gophie_circuit_state{labels} {state}")
+    for field, help in (
+        ("opened", "Times the circuit of each engine opened"),
+        ("rejected", "Requests not sent while the circuit was open"),
+    ):
+        name = f"ocena_gophie_circuit_{field}_total"
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} counter"])
+        for engine, engine_stats in stats:
+            labels = format_labels(("engine",), (engine,))
+            lines.append(f"{name}{labels} {engine_stats[field]}")
+    return lines
+
+
+def render_timeouts():
+    lines = [
+        "# HELP ocena_gophie_timeout_seconds Adaptive timeout of each engine",
+        "# TYPE ocena_gophie_timeout_seconds gauge",
+    ]
+    for engine, engine_stats in sorted(latency.stats().items()):
+        labels = format_labels(("engine",), (engine,))
+        lines.append(f"ocena_gophie_timeout_seconds{labels} {engine_stats['timeout']}")
+    return lines
+
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    lines.extend(render_caches())
+    lines.extend(render_circuits())
+    lines.extend(render_timeouts())
+    return "\n".join(lines) + "\n"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    queries = _queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+class MetricsMiddleware:
+    """
+    Records the latency and database statements of every HTTP request by
+    route template, unmatched paths share the `unmatched` route
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def route_of(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self._routes:
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    self._routes[endpoint] = route.path
+                    break
+            else:
+                return "unmatched"
+        return self._routes[endpoint]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        # the list is shared with the threadpool and greenlets the request
+        # runs its queries in, as they copy the context
+        queries = [0]
+        token = _queries.set(queries)
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.dec()
+            _queries.reset(token)
+            method, route = scope["method"], self.route_of(scope)
+            request_latency.observe(elapsed, method=method, route=route, status=status)
+            request_queries.observe(queries[0], method=method, route=route)
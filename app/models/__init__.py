@@ -1,51 +1,53 @@
-from datetime import datetime
-
-from sqlalchemy.orm import Session
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 
 from app import settings
+from app.models import pool
 
 Base = declarative_base()
 
-if settings.debug:
-    #     engine = create_engine(settings.database_url, connect_args={"check_same_thread": False})
-    engine = create_engine(settings.database_url)
+if settings.database_url.startswith("sqlite"):
+    # async routes hop between the event loop and threadpool workers
+    engine = create_engine(
+        settings.database_url,
+        connect_args={"check_same_thread": False},
+        **pool.pool_options("sync", settings.database_url),
+    )
 else:
-    engine = create_engine(settings.database_url)
-
-
-class HashableSession(Session):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-    def __repr__(self):
-        return str(datetime.now().date())
+    engine = create_engine(
+        settings.database_url, **pool.pool_options("sync", settings.database_url)
+    )
+pool.instrument(engine, "sync")
 
-    def __hash__(self):
-        return hash(repr(self))
 
-    def __eq__(self, other):
-        return self.__hash__() == other.__hash__()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# async drivers of each dialect
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
 
-class HashableParams(dict):
-    def __repr__(self):
-        x = ", ".join([str(val) for val in self.values()])
-        x += f":-{str(datetime.now().date())}"
-        return x
 
-    def __hash__(self):
-        return hash(repr(self))
+def async_database_url(url: str):
+    """The database url with the async driver of its dialect"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
 
-    def __eq__(self, other):
-        return self.__hash__() == other.__hash__()
 
+if settings.async_database:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
-SessionLocal = sessionmaker(
-    autocommit=False, class_=HashableSession, autoflush=False, bind=engine
-)
+    async_engine = create_async_engine(
+        async_database_url(settings.database_url),
+        **pool.pool_options(
+            "async", settings.database_url, poolclass=pool.TimedAsyncQueuePool
+        ),
+    )
+    pool.instrument(async_engine.sync_engine, "async")
+    AsyncSessionLocal = sessionmaker(
+        autoflush=False, bind=async_engine, class_=AsyncSession
+    )
 
 
 def get_db():
@@ -55,3 +57,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """Get Async Database Object"""
+    async with AsyncSessionLocal() as db:
+        yield db
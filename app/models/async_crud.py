@@ -0,0 +1,58 @@
+"""
+Async versions of the crud functions. On an AsyncSession the sync functions
+run on the session's async connection through run_sync, without a thread,
+and on a sync Session they run in the threadpool
+"""
+import functools
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.models import crud, schemas
+
+
+async def run(db, func, *args, **kwargs):
+    """Calls func(session, *args, **kwargs) with the sync side of db"""
+    if isinstance(db, Session):
+        return await run_in_threadpool(func, db, *args, **kwargs)
+    return await db.run_sync(func, *args, **kwargs)
+
+
+def run_sync(func):
+    """Async version of a crud function taking the session as its first argument"""
+
+    @functools.wraps(func)
+    async def wrapper(db, *args, **kwargs):
+        return await run(db, func, *args, **kwargs)
+
+    return wrapper
+
+
+def first_movie_by_schema(db: Session, movie: schemas.MovieBase):
+    """
+    The movie matching a schema, converted while its relationships can
+    still be loaded
+    """
+    db_movie = crud.get_movie_by_schema(db, movie).first()
+    return schemas.Movie.from_orm(db_movie) if db_movie else None
+
+
+get_movie = run_sync(crud.get_movie)
+list_movies = run_sync(crud.list_movies)
+search_movies = run_sync(crud.search_movies)
+movie_schemas = run_sync(crud.movie_schemas)
+get_movie_by_referral_id = run_sync(crud.get_movie_by_referral_id)
+get_movie_by_schema = run_sync(first_movie_by_schema)
+create_movie = run_sync(crud.create_movie)
+upsert_movies = run_sync(crud.upsert_movies)
+create_movie_by_moviecreate = run_sync(crud.create_movie_by_moviecreate)
+get_movie_ratings = run_sync(crud.get_movie_ratings)
+get_movie_average_ratings = run_sync(crud.get_movie_average_ratings)
+create_or_update_rating = run_sync(crud.create_or_update_rating)
+get_rating = run_sync(crud.get_rating)
+create_download = run_sync(crud.create_download)
+get_number_of_downloads = run_sync(crud.get_number_of_downloads)
+get_highest_downloads = run_sync(crud.get_highest_downloads)
+create_referral = run_sync(crud.create_referral)
+get_movies_stats = run_sync(crud.get_movies_stats)
+get_no_of_referrals = run_sync(crud.get_no_of_referrals)
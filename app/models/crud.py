@@ -1,12 +1,17 @@
 import uuid
 import datetime
-from functools import lru_cache
+import collections
 
-from sqlalchemy.orm import Session
-from sqlalchemy import exc, func
+from typing import List
 
-from app.models import models, schemas, HashableSession
-from app.models.utils import add_ratings, get_movie_download
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import exc, func, null, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import cache, resolver, search, trending, writebehind
+from app.settings import settings
+from app.models import models, schemas
+from app.models.utils import average_rating, download_bucket_start
 
 
 def get_movie(db: Session, movie_id: int):
@@ -16,50 +21,202 @@ def get_movie(db: Session, movie_id: int):
     return db.query(models.Movie).filter(models.Movie.id == movie_id).first()
 
 
-@lru_cache(maxsize=4096)
-def list_movies(db: HashableSession, engine: str, page: int, num: int):
+def list_movies(
+    db: Session,
+    engine: str,
+    page: int,
+    num: int,
+    after: list = None,
+    full: bool = False,
+):
     """
-    Get List of Movies. With pagination and a total of `num` rows per query
+    Get List of Movies, newest first with a total of `num` rows per query.
+    Pages after the (date_created, id) keyset `after` when it is given,
+    else after `page - 1` pages. See movie_schemas for `full`
     """
-    print(
-        list(
-            db.query(models.Movie, func.avg(models.Rating.score))
-            .join(models.Rating)
-            .order_by(models.Movie.date_created.desc())
-            .group_by(models.Movie.id)
-            .filter(func.lower(models.Movie.engine) == engine.lower())
-            .limit(num)
-            .offset(num * (page - 1))
-        )
-    )
-    return []
-
-
-@lru_cache(maxsize=4096)
-def search_movies(db: HashableSession, engine: str, query: str, page: int, num: int):
+    movies, after = list_movie_page(db, engine, page, num, after)
+    return schemas.MoviePage(movies=movie_schemas(db, movies, full), after=after)
+
+
+@cache.cached(
+    "list_movies",
+    key=lambda db, engine, page, num, after=None: (
+        engine.lower(),
+        page,
+        num,
+        tuple(after) if after else None,
+    ),
+)
+def list_movie_page(db: Session, engine: str, page: int, num: int, after=None):
     """
-    Search movies using fuzzy partial
+    The movies of a listing page and the keyset of the next one. Only the
+    movies are cached, their counts are read per request by movie_schemas
     """
-    # TODO Improve fuzzy searching
-    return list(
+    query = (
         db.query(models.Movie)
         .filter(
-            models.Movie.name.ilike("%" + query + "%"),
             func.lower(models.Movie.engine) == engine.lower(),
+            # searched movies are not part of the listing
+            models.Movie.date_created.isnot(None),
         )
-        .limit(num)
-        .offset(num * (page - 1))
+        .order_by(models.Movie.date_created.desc(), models.Movie.id.desc())
+    )
+    if after:
+        query = query.filter(
+            tuple_(models.Movie.date_created, models.Movie.id)
+            < tuple_(datetime.datetime.fromisoformat(after[0]), int(after[1]))
+        )
+    else:
+        query = query.offset(num * (page - 1))
+    movies = query.limit(num).all()
+    return (
+        [schemas.MovieReferral.from_orm(movie) for movie in movies],
+        (
+            [movies[-1].date_created.isoformat(), movies[-1].id]
+            if movies and len(movies) == num
+            else None
+        ),
     )
 
 
-@lru_cache(maxsize=256)
-def get_movie_by_referral_id(db: HashableSession, referral_id: str):
+def search_movies(
+    db: Session,
+    engine: str,
+    query: str,
+    page: int,
+    num: int,
+    after: list = None,
+    full: bool = False,
+):
     """
-    Get Movie by referral id
+    Search movies using the configured search backend, ranked by similarity
+    where the backend supports it. Pages after the (rank, id) keyset `after`
+    when it is given, else after `page - 1` pages. See movie_schemas for
+    `full`
+    """
+    movies, after = search_movie_page(db, engine, query, page, num, after)
+    return schemas.MoviePage(movies=movie_schemas(db, movies, full), after=after)
+
+
+@cache.cached(
+    "search_movies",
+    key=lambda db, engine, query, page, num, after=None: (
+        engine.lower(),
+        query,
+        page,
+        num,
+        tuple(after) if after else None,
+    ),
+)
+def search_movie_page(
+    db: Session, engine: str, query: str, page: int, num: int, after=None
+):
+    """
+    The movies of a search page and the keyset of the next one, cached
+    without their counts like list_movie_page
+    """
+    ranked = search.get_backend(db).search(db, engine, query, page, num, after)
+    return (
+        [schemas.MovieReferral.from_orm(movie) for _, movie in ranked],
+        [ranked[-1][0], ranked[-1][1].id] if ranked and len(ranked) == num else None,
+    )
+
+
+def movie_schemas(db: Session, movies: List[schemas.MovieReferral], full: bool = False):
+    """
+    Schemas of a page of movies with their current ratings and counts.
+    Summaries get them from one grouped query, full movies get their
+    ratings, referrals and downloads from one query per relationship
+    """
+    movie_ids = [movie.id for movie in movies]
+    if full:
+        loaded = (
+            db.query(models.Movie)
+            .filter(models.Movie.id.in_(movie_ids))
+            .options(
+                selectinload(models.Movie.ratings),
+                selectinload(models.Movie.referrals),
+                selectinload(models.Movie.downloads),
+            )
+            .populate_existing()
+        )
+        loaded = {movie.id: movie for movie in loaded}
+        return [
+            schemas.Movie.from_orm(loaded[movie.id])
+            for movie in movies
+            if movie.id in loaded
+        ]
+    counts = get_movie_counts(db, movie_ids)
+    return [
+        schemas.MovieSummary(
+            **movie.dict(),
+            average_ratings={
+                "average_ratings": average_rating(*counts[movie.id][:2]),
+                "by": counts[movie.id][1],
+            },
+            downloads=counts[movie.id][2],
+            referrals=counts[movie.id][3],
+        )
+        for movie in movies
+        if movie.id in counts
+    ]
+
+
+def downloads_by_movie(db: Session, movie_ids: List[int]):
+    """
+    Query of the (movie_id, count) downloads of movies. Downloads are
+    counted from their hourly buckets everywhere, which are written in the
+    same transaction as the downloads
     """
     return (
-        db.query(models.Movie).filter(models.Movie.referral_id == referral_id).first()
+        db.query(
+            models.DownloadBucket.movie_id,
+            func.sum(models.DownloadBucket.count).label("count"),
+        )
+        .filter(models.DownloadBucket.movie_id.in_(movie_ids))
+        .group_by(models.DownloadBucket.movie_id)
+    )
+
+
+def get_movie_counts(db: Session, movie_ids: List[int]):
+    """
+    Maps movie ids to their (rating sum, raters, downloads, referrals) in
+    one query
+    """
+    downloads = downloads_by_movie(db, movie_ids).subquery()
+    referrals = (
+        db.query(
+            models.Referral.movie_id, func.count(models.Referral.id).label("count")
+        )
+        .filter(models.Referral.movie_id.in_(movie_ids))
+        .group_by(models.Referral.movie_id)
+        .subquery()
+    )
+    rows = (
+        db.query(
+            models.Movie.id,
+            func.coalesce(models.Movie.rating_sum, 0),
+            func.coalesce(models.Movie.rating_count, 0),
+            func.coalesce(downloads.c.count, 0),
+            func.coalesce(referrals.c.count, 0),
+        )
+        .outerjoin(downloads, downloads.c.movie_id == models.Movie.id)
+        .outerjoin(referrals, referrals.c.movie_id == models.Movie.id)
+        .filter(models.Movie.id.in_(movie_ids))
     )
+    return {movie_id: tuple(counts) for movie_id, *counts in rows}
+
+
+@cache.cached("get_movie_by_referral_id", key=lambda db, referral_id: referral_id)
+def get_movie_by_referral_id(db: Session, referral_id: str):
+    """
+    Get Movie by referral id
+    """
+    ref = resolver.resolve(db, referral_id)
+    if ref is None:
+        return None
+    movie = get_movie(db, ref.id)
+    return schemas.MovieReferral.from_orm(movie) if movie else None
 
 
 def get_movie_by_schema(db: Session, movie: schemas.MovieCreate):
@@ -127,9 +284,118 @@ def create_movie(db: Session, db_movie: models.Movie):
             movie.referral_id = str(uuid.uuid4())
         db.commit()
         db_movie = movie
+    cache.fire("movies_saved", movies=[db_movie])
     return db_movie
 
 
+# Fields that keep their stored value when upstream sends an empty one
+MERGED_MOVIE_FIELDS = (
+    "download_link",
+    "description",
+    "size",
+    "year",
+    "quality",
+    "s_download_link",
+    "category",
+    "cast",
+    "upload_date",
+    "subtitle_link",
+    "subtitle_links",
+    "imdb_link",
+    "tags",
+    "date_created",
+)
+# Fields that are always replaced by the upstream value
+REPLACED_MOVIE_FIELDS = ("cover_photo_link", "is_series")
+
+
+def dialect_insert(db: Session, table):
+    """
+    INSERT construct for the session's dialect, which supports ON CONFLICT
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def movie_to_row(db_movie: models.Movie):
+    """
+    Converts an unsaved movie to a row for bulk inserts, empty values become NULL
+    """
+    row = {
+        "name": db_movie.name,
+        "engine": db_movie.engine,
+        "referral_id": db_movie.referral_id or str(uuid.uuid4()),
+    }
+    for field in MERGED_MOVIE_FIELDS:
+        row[field] = getattr(db_movie, field) or None
+    for field in REPLACED_MOVIE_FIELDS:
+        row[field] = getattr(db_movie, field)
+    return row
+
+
+def merge_movie_rows(old: dict, new: dict):
+    """
+    Merges two rows of the same movie using the same rules as create_movie
+    """
+    merged = dict(new, referral_id=old["referral_id"])
+    for field in MERGED_MOVIE_FIELDS:
+        if new[field] is None:
+            merged[field] = old[field]
+    return merged
+
+
+def upsert_movies(db: Session, db_movies: List[models.Movie]):
+    """
+    Creates or updates a page of movies in a single statement and returns
+    the stored movies in the order they were given
+    """
+    if not db_movies:
+        return []
+    rows = {}
+    for db_movie in db_movies:
+        row = movie_to_row(db_movie)
+        key = (row["name"], row["engine"])
+        rows[key] = merge_movie_rows(rows[key], row) if key in rows else row
+
+    table = models.Movie.__table__
+    stmt = dialect_insert(db, table)
+    update = {
+        field: func.coalesce(stmt.excluded[field], table.c[field])
+        for field in MERGED_MOVIE_FIELDS
+    }
+    update.update({field: stmt.excluded[field] for field in REPLACED_MOVIE_FIELDS})
+    update["referral_id"] = func.coalesce(
+        table.c.referral_id, stmt.excluded.referral_id
+    )
+    # null() keeps JSON columns as SQL NULL instead of a JSON 'null'
+    values = [
+        {field: null() if value is None else value for field, value in row.items()}
+        for row in rows.values()
+    ]
+    db.execute(
+        stmt.values(values).on_conflict_do_update(
+            index_elements=["name", "engine"], set_=update
+        )
+    )
+    db.commit()
+
+    names = {name for name, _ in rows}
+    engines = {engine for _, engine in rows}
+    stored = {
+        (movie.name, movie.engine): movie
+        for movie in db.query(models.Movie).filter(
+            models.Movie.name.in_(names), models.Movie.engine.in_(engines)
+        )
+    }
+    cache.fire("movies_saved", movies=list(stored.values()))
+    return [
+        stored[(db_movie.name, db_movie.engine)]
+        for db_movie in db_movies
+        if (db_movie.name, db_movie.engine) in stored
+    ]
+
+
 def create_movie_by_moviecreate(db: Session, movie: schemas.MovieCreate):
     """
     Creates a movie or retrieves it by using MovieCreate
@@ -142,57 +408,66 @@ def get_movie_ratings(db: Session, movie: schemas.MovieRating):
     """
     Get all rating objects of a movie
     """
-    movie = (
-        db.query(models.Movie)
-        .filter(models.Movie.referral_id == movie.referral_id)
-        .first()
-    )
-    if movie:
-        return movie.ratings
-    else:
+    ref = resolver.resolve(db, movie.referral_id)
+    if ref is None:
         return []
+    return db.query(models.Rating).filter(models.Rating.movie_id == ref.id).all()
 
 
 def get_movie_average_ratings(db: Session, movie: schemas.MovieRating):
     """
     Get the average ratings and number of raters of a particular movie
     """
-    db_movie = (
-        db.query(models.Movie)
-        .filter(models.Movie.referral_id == movie.referral_id)
+    ref = resolver.resolve(db, movie.referral_id)
+    aggregates = (
+        db.query(models.Movie.rating_sum, models.Movie.rating_count)
+        .filter(models.Movie.id == ref.id)
         .first()
+        if ref
+        else None
     )
-    total_sum = add_ratings(db_movie.ratings)
-    if len(db_movie.ratings) > 0:
-        average_ratings = total_sum / len(db_movie.ratings)
-        return schemas.AverageRating(
-            average_ratings=average_ratings, by=len(db_movie.ratings)
-        )
-    else:
+    if aggregates is None:
         return schemas.AverageRating(average_ratings=0, by=0)
+    rating_sum, rating_count = aggregates
+    return schemas.AverageRating(
+        average_ratings=average_rating(rating_sum, rating_count), by=rating_count
+    )
 
 
 def create_or_update_rating(db: Session, spec_rating: schemas.SpecificRatingScore):
-    movie = (
-        db.query(models.Movie)
-        .filter(models.Movie.referral_id == spec_rating.referral_id)
+    """
+    Create or update a rating and apply the change to the movie's rating
+    aggregates in the same transaction
+    """
+    movie = resolver.resolve(db, spec_rating.referral_id)
+    score = int(spec_rating.score)
+    db_rating = (
+        get_rating_by_schema(
+            db,
+            schemas.IndexedRating(ip_address=spec_rating.ip_address, movie_id=movie.id),
+        )
+        .with_for_update()
         .first()
     )
-    db_rating_query = get_rating_by_schema(
-        db, schemas.IndexedRating(ip_address=spec_rating.ip_address, movie_id=movie.id)
-    )
-    if db_rating_query.count() < 1:
+    if db_rating is None:
         db_rating = models.Rating(
-            ip_address=spec_rating.ip_address,
-            score=spec_rating.score,
-            movie_id=movie.id,
+            ip_address=spec_rating.ip_address, score=score, movie_id=movie.id
         )
         db.add(db_rating)
+        sum_delta, count_delta = score, 1
     else:
-        db_rating = db_rating_query.first()
-        db_rating.score = spec_rating.score
+        sum_delta, count_delta = score - db_rating.score, 0
+        db_rating.score = score
+    db.query(models.Movie).filter(models.Movie.id == movie.id).update(
+        {
+            models.Movie.rating_sum: models.Movie.rating_sum + sum_delta,
+            models.Movie.rating_count: models.Movie.rating_count + count_delta,
+        },
+        synchronize_session=False,
+    )
     db.commit()
     db.refresh(db_rating)
+    cache.fire("rating_saved", movie=movie)
     return db_rating
 
 
@@ -200,127 +475,281 @@ def get_rating(db: Session, spec_rating: schemas.SpecificRating):
     """
     Gets the specific rating of a particular movie by an ip_address
     """
-    db_query = db.query(models.Movie).filter(
-        models.Movie.referral_id == spec_rating.referral_id
-    )
-    if db_query.count() >= 1:
-        movie = db_query.first()
-        rating = (
-            db.query(models.Rating)
-            .filter(
-                models.Rating.ip_address == spec_rating.ip_address,
-                models.Rating.movie_id == movie.id,
-            )
-            .first()
-        )
-    else:
+    movie = resolver.resolve(db, spec_rating.referral_id)
+    if movie is None:
         return 0
-    return rating
+    return (
+        db.query(models.Rating)
+        .filter(
+            models.Rating.ip_address == spec_rating.ip_address,
+            models.Rating.movie_id == movie.id,
+        )
+        .first()
+    )
 
 
 def create_download(db: Session, download: schemas.DownloadCreate):
     """
-    Creates a particular download object
+    Creates a particular download object, in write-behind mode it is queued
+    and returned without an id
     """
-    movie = (
-        db.query(models.Movie)
-        .filter(models.Movie.referral_id == download.referral_id)
-        .first()
-    )
+    movie = resolver.resolve(db, download.referral_id)
     db_download = models.Download(
         movie_id=movie.id,
         ip_address=download.ip_address,
         datetime=datetime.datetime.utcnow(),
     )
+    if settings.write_behind_enabled and writebehind.buffer.put(
+        "downloads", event_row(db_download, movie)
+    ):
+        # download_created is fired by insert_downloads once it is written
+        return db_download
     db.add(db_download)
+    increment_download_buckets(
+        db, {(movie.id, download_bucket_start(db_download.datetime)): 1}
+    )
     db.commit()
     db.refresh(db_download)
+    cache.fire("download_created", movie=movie, downloaded_at=db_download.datetime)
     return db_download
 
 
+def event_row(db_event, movie: resolver.MovieRef):
+    """
+    Row of a download or referral for the write-behind buffer, with the
+    movie its event is fired for
+    """
+    return {
+        "movie": movie,
+        "ip_address": db_event.ip_address,
+        "datetime": db_event.datetime,
+    }
+
+
+def event_columns(rows: List[dict]):
+    """
+    Column values of buffered download or referral rows
+    """
+    return [
+        {
+            "movie_id": row["movie"].id,
+            "ip_address": row["ip_address"],
+            "datetime": row["datetime"],
+        }
+        for row in rows
+    ]
+
+
+@writebehind.writer("downloads")
+def insert_downloads(db: Session, rows: List[dict]):
+    """
+    Writes downloads with one multi-row INSERT and adds them to their
+    hourly buckets, without committing. download_created is fired for each
+    once they are committed
+    """
+    db.execute(models.Download.__table__.insert().values(event_columns(rows)))
+    counts = collections.Counter(
+        (row["movie"].id, download_bucket_start(row["datetime"])) for row in rows
+    )
+    increment_download_buckets(db, counts)
+
+    def committed():
+        for row in rows:
+            cache.fire(
+                "download_created", movie=row["movie"], downloaded_at=row["datetime"]
+            )
+
+    return committed
+
+
+def increment_download_buckets(db: Session, counts: dict):
+    """
+    Adds download counts keyed by (movie_id, bucket_start) to their hourly
+    rollup buckets, without committing
+    """
+    table = models.DownloadBucket.__table__
+    stmt = dialect_insert(db, table)
+    # executemany, the statement is compiled once however many buckets change
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["movie_id", "bucket_start"],
+            set_={"count": table.c.count + stmt.excluded["count"]},
+        ),
+        [
+            {"movie_id": movie_id, "bucket_start": bucket_start, "count": count}
+            for (movie_id, bucket_start), count in counts.items()
+        ],
+    )
+
+
 def get_number_of_downloads(db: Session, movie: schemas.MovieRating):
     """
     Get number of downloads
     """
-    db_query = db.query(models.Movie).filter(
-        models.Movie.referral_id == movie.referral_id
-    )
-    if db_query.count() < 1:
+    ref = resolver.resolve(db, movie.referral_id)
+    if ref is None:
         return 0
-    else:
-        db_movie = db_query.first()
-    return len(db_movie.downloads)
+    row = downloads_by_movie(db, [ref.id]).first()
+    return row.count if row else 0
 
 
-@lru_cache(maxsize=128)
-def get_highest_downloads(db: HashableSession, filter_: schemas.DownloadFilter):
+@cache.cached(
+    "get_highest_downloads",
+    key=lambda db, filter_: (filter_.filter_by, filter_.filter_num, filter_.top),
+)
+def get_highest_downloads(db: Session, filter_: schemas.DownloadFilter):
     """
-    Gets the x highest downloaded movies in the last period
+    Gets the x highest downloaded movies in the last period, summed from the
+    hourly download buckets so the period is accurate to the hour
     """
     options = {
         "weeks": datetime.timedelta(weeks=filter_.filter_num),
         "hours": datetime.timedelta(hours=filter_.filter_num),
         "days": datetime.timedelta(days=filter_.filter_num),
     }
-    x_times_ago = datetime.datetime.utcnow() - options[filter_.filter_by]
-    downloads_in_the_last_x_times = (
-        db.query(models.Download).filter(models.Download.datetime > x_times_ago).all()
-    )
-    movie_map = get_movie_download(downloads_in_the_last_x_times)
-    movie_downloads = [
+    window = options[filter_.filter_by]
+    if settings.trending_enabled and trending.downloads.covers(window):
+        ranking = trending.downloads.top(window, filter_.top)
+        movies = (
+            db.query(models.Movie)
+            .filter(models.Movie.id.in_([movie_id for movie_id, _ in ranking]))
+            .all()
+        )
+        movies_by_id = {movie.id: movie for movie in movies}
+        movie_map = [
+            (movies_by_id[movie_id], downloads)
+            for movie_id, downloads in ranking
+            if movie_id in movies_by_id
+        ]
+    else:
+        movie_map = get_highest_downloads_from_buckets(db, window, filter_.top)
+    return [
         schemas.MovieDownloads(
-            id=get_movie(db, int(mov_key)).id,
-            name=get_movie(db, int(mov_key)).name,
-            engine=get_movie(db, int(mov_key)).engine,
-            downloads=downloads,
-            description=get_movie(db, int(mov_key)).description,
-            size=get_movie(db, int(mov_key)).size,
-            download_link=get_movie(db, int(mov_key)).download_link,
-            cover_photo_link=get_movie(db, int(mov_key)).cover_photo_link,
-            referral_id=get_movie(db, int(mov_key)).referral_id,
-            quality=get_movie(db, int(mov_key)).quality,
-            is_series=get_movie(db, int(mov_key)).is_series,
-            s_download_link=get_movie(db, int(mov_key)).s_download_link,
-            category=get_movie(db, int(mov_key)).category,
-            cast=get_movie(db, int(mov_key)).cast,
-            upload_date=get_movie(db, int(mov_key)).upload_date,
-            subtitle_link=get_movie(db, int(mov_key)).subtitle_link,
-            subtitle_links=get_movie(db, int(mov_key)).subtitle_links,
-            imdb_link=get_movie(db, int(mov_key)).imdb_link,
-            tags=get_movie(db, int(mov_key)).tags,
+            **schemas.MovieReferral.from_orm(movie).dict(), downloads=downloads
         )
-        for mov_key, downloads in movie_map.most_common(filter_.top)
+        for movie, downloads in movie_map
     ]
-    return movie_downloads
 
 
-def create_referral(db: Session, referral: schemas.ReferralCreate):
+def get_highest_downloads_from_buckets(
+    db: Session, window: datetime.timedelta, top: int
+):
     """
-    Creates a particular referral object (for data tracking purposes)
+    Ranks movies by their downloads in the last window using the hourly
+    download buckets, with the movie rows fetched in the same query
     """
-    movie = (
-        db.query(models.Movie)
-        .filter(models.Movie.referral_id == referral.referral_id)
-        .first()
+    since = download_bucket_start(datetime.datetime.utcnow() - window)
+    downloads = func.sum(models.DownloadBucket.count).label("downloads")
+    ranking = (
+        db.query(models.DownloadBucket.movie_id, downloads)
+        .filter(models.DownloadBucket.bucket_start >= since)
+        .group_by(models.DownloadBucket.movie_id)
+        .order_by(downloads.desc())
+        .limit(top)
+        .subquery()
     )
+    return (
+        db.query(models.Movie, ranking.c.downloads)
+        .join(ranking, models.Movie.id == ranking.c.movie_id)
+        .order_by(ranking.c.downloads.desc(), models.Movie.id)
+        .all()
+    )
+
+
+def create_referral(db: Session, referral: schemas.ReferralCreate):
+    """
+    Creates a particular referral object (for data tracking purposes), in
+    write-behind mode it is queued and returned without an id
+    """
+    movie = resolver.resolve(db, referral.referral_id)
     db_referral = models.Referral(
         movie_id=movie.id,
         ip_address=referral.ip_address,
         datetime=datetime.datetime.utcnow(),
     )
+    if settings.write_behind_enabled and writebehind.buffer.put(
+        "referrals", event_row(db_referral, movie)
+    ):
+        # referral_created is fired by insert_referrals once it is written
+        return db_referral
     db.add(db_referral)
     db.commit()
     db.refresh(db_referral)
+    cache.fire("referral_created", movie=movie)
     return db_referral
 
 
+def get_movies_stats(db: Session, batch: schemas.MovieBatch):
+    """
+    Get the average ratings, number of raters, downloads and referrals of
+    several movies with one grouped query, see get_movie_counts
+    """
+    refs = resolver.resolve_many(db, batch.referral_ids)
+    counts = get_movie_counts(db, [ref.id for ref in refs.values()])
+    stats = []
+    for referral_id in batch.referral_ids:
+        ref = refs.get(referral_id)
+        rating_sum, by, downloads, referrals = (
+            counts.get(ref.id, (0, 0, 0, 0)) if ref else (0, 0, 0, 0)
+        )
+        stats.append(
+            schemas.MovieStats(
+                referral_id=referral_id,
+                average_ratings=average_rating(rating_sum, by),
+                by=by,
+                downloads=downloads,
+                referrals=referrals,
+            )
+        )
+    return stats
+
+
+@writebehind.writer("referrals")
+def insert_referrals(db: Session, rows: List[dict]):
+    """
+    Writes referrals with one multi-row INSERT, without committing.
+    referral_created is fired for each once they are committed
+    """
+    db.execute(models.Referral.__table__.insert().values(event_columns(rows)))
+
+    def committed():
+        for row in rows:
+            cache.fire("referral_created", movie=row["movie"])
+
+    return committed
+
+
 def get_no_of_referrals(db: Session, movie: schemas.MovieRating):
     """
     Get number of referrals
     """
-    db_movie = (
-        db.query(models.Movie)
-        .filter(models.Movie.referral_id == movie.referral_id)
-        .first()
+    ref = resolver.resolve(db, movie.referral_id)
+    if ref is None:
+        return 0
+    return (
+        db.query(func.count(models.Referral.id))
+        .filter(models.Referral.movie_id == ref.id)
+        .scalar()
     )
-    return len(db_movie.referrals)
+
+
+# Cache invalidation, cached pages hold the movies without their ratings
+# and counts so only saving movies makes them stale. The highest downloads
+# expire after their short TTL
+
+
+def invalidate_engine_pages(engine: str):
+    """
+    Drops every cached listing and search page of an engine
+    """
+    engine = engine.lower()
+    list_movie_page.cache.invalidate_where(lambda key: key[0] == engine)
+    search_movie_page.cache.invalidate_where(lambda key: key[0] == engine)
+
+
+@cache.on("movies_saved")
+def invalidate_saved_movies(movies: List[models.Movie]):
+    for engine in {movie.engine for movie in movies}:
+        invalidate_engine_pages(engine)
+    for movie in movies:
+        get_movie_by_referral_id.cache.invalidate(movie.referral_id)
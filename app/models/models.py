@@ -5,14 +5,17 @@ from sqlalchemy import (
     ForeignKey,
     Integer,
     DateTime,
+    Index,
     String,
     UniqueConstraint,
     JSON,
     DateTime,
+    func,
 )
 from sqlalchemy.orm import relationship
 
 from app.models import Base
+from app.models.utils import average_rating
 
 
 class Movie(Base):
@@ -29,7 +32,7 @@ class Movie(Base):
     size = Column(String)
     year = Column(String)
     download_link = Column(String)
-    referral_id = Column(String)
+    referral_id = Column(String, unique=True, index=True)
     cover_photo_link = Column(String)
     quality = Column(String)
     is_series = Column(Boolean)
@@ -41,15 +44,35 @@ class Movie(Base):
     subtitle_links = Column(JSON)
     imdb_link = Column(String)
     tags = Column(String)
+    # rating aggregates, kept in step with the ratings table
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     # relationships
     referrals = relationship("Referral", back_populates="owner")
     downloads = relationship("Download", back_populates="owner")
     ratings = relationship("Rating", back_populates="owner")
 
+    @property
+    def average_ratings(self):
+        return {
+            "average_ratings": average_rating(self.rating_sum, self.rating_count),
+            "by": self.rating_count or 0,
+        }
+
+
+# keyset pagination of engine listings, newest first
+Index(
+    "ix_movies_engine_date_created",
+    func.lower(Movie.engine),
+    Movie.date_created,
+    Movie.id,
+)
+
 
 class Download(Base):
     __tablename__ = "downloads"
+    __table_args__ = (Index("ix_downloads_movie_id_datetime", "movie_id", "datetime"),)
 
     id = Column(Integer, primary_key=True, index=True)
     movie_id = Column(Integer, ForeignKey("movies.id"))
@@ -59,8 +82,19 @@ class Download(Base):
     owner = relationship("Movie", back_populates="downloads")
 
 
+class DownloadBucket(Base):
+    """Hourly rollup of a movie's downloads"""
+
+    __tablename__ = "download_buckets"
+
+    movie_id = Column(Integer, ForeignKey("movies.id"), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True, index=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
 class Referral(Base):
     __tablename__ = "referrals"
+    __table_args__ = (Index("ix_referrals_movie_id_datetime", "movie_id", "datetime"),)
 
     id = Column(Integer, primary_key=True, index=True)
     movie_id = Column(Integer, ForeignKey("movies.id"))
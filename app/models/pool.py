@@ -0,0 +1,150 @@
+"""
+Connection pool settings and instrumentation
+"""
+import time
+import threading
+from typing import Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+
+from app.settings import settings
+
+
+class PoolStats:
+    """
+    Checkout wait times, pool usage and connection lifetimes of an engine's
+    pool, the pool is read from the engine as it is replaced on dispose
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_in_use = 0
+        self.max_overflow = 0
+        self.opened = 0
+        self.closed = 0
+        self.total_lifetime_seconds = 0.0
+        self.max_lifetime_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def checked_out(self, pool, waited: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.max_in_use = max(self.max_in_use, pool.checkedout())
+            self.max_overflow = max(self.max_overflow, pool.overflow())
+
+    def timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def connected(self, dbapi_connection, connection_record):
+        connection_record.info["connected_at"] = time.monotonic()
+        with self._lock:
+            self.opened += 1
+
+    def closed_connection(self, dbapi_connection, connection_record):
+        connected_at = connection_record.info.pop("connected_at", None)
+        with self._lock:
+            self.closed += 1
+            if connected_at is not None:
+                lifetime = time.monotonic() - connected_at
+                self.total_lifetime_seconds += lifetime
+                self.max_lifetime_seconds = max(self.max_lifetime_seconds, lifetime)
+
+    def stats(self):
+        pool = self.engine.pool
+        if not isinstance(pool, QueuePool):
+            return {"pool": type(pool).__name__, "checkouts": self.checkouts}
+        return {
+            "size": pool.size(),
+            "in_use": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_in_use": self.max_in_use,
+            "max_overflow": self.max_overflow,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "average_wait_seconds": self.total_wait_seconds / (self.checkouts or 1),
+            "max_wait_seconds": self.max_wait_seconds,
+            "opened": self.opened,
+            "closed": self.closed,
+            "average_lifetime_seconds": (
+                self.total_lifetime_seconds / (self.closed or 1)
+            ),
+            "max_lifetime_seconds": self.max_lifetime_seconds,
+        }
+
+
+_stats: Dict[str, PoolStats] = {}
+
+
+class TimedCheckout:
+    """Records how long each checkout waits for a connection"""
+
+    def connect(self):
+        stats = _stats.get(self.logging_name)
+        start = time.monotonic()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            if stats:
+                stats.timed_out()
+            raise
+        if stats:
+            stats.checked_out(self, time.monotonic() - start)
+        return connection
+
+
+class TimedQueuePool(TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def in_memory(url: str):
+    """Whether a database url is an in-memory SQLite database"""
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    )
+
+
+def pool_options(name: str, url: str, poolclass=TimedQueuePool):
+    """
+    create_engine arguments of a pool configured from settings. In-memory
+    SQLite databases live as long as their connection, so they share one
+    """
+    if in_memory(url):
+        return {"poolclass": StaticPool, "pool_logging_name": name}
+    return {
+        "poolclass": poolclass,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        # names the pool's stats
+        "pool_logging_name": name,
+    }
+
+
+def instrument(engine, name: str):
+    """Starts recording the stats of an engine's pool"""
+    _stats[name] = stats = PoolStats(engine)
+    event.listen(engine, "connect", stats.connected)
+    event.listen(engine, "close", stats.closed_connection)
+    return stats
+
+
+def stats():
+    """Returns the stats of every instrumented pool"""
+    return {name: pool_stats.stats() for name, pool_stats in _stats.items()}
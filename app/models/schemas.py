@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Union
 
-from pydantic import BaseModel, root_validator
+from pydantic import BaseModel, conlist, root_validator
 
 # Rating schemas
 
@@ -76,20 +76,10 @@ class DownloadFilter(BaseModel):
     filter_num: int
     top: int
 
-    def __repr__(self):
-        day = datetime.today().strftime("%d%m%Y")
-        return f"Top {str(self.top)} in the last {str(self.filter_num)} {self.filter_by} on {day}"
-
-    def __hash__(self):
-        return hash(repr(self))
-
-    def __eq__(self, other):
-        print(self.__hash__(), other.__hash__())
-        return self.__hash__() == other.__hash__()
-
 
 class Download(DownloadBase):
-    id: int
+    # not set while the download waits in the write-behind buffer
+    id: Optional[int]
     movie_id: int
     datetime: datetime
 
@@ -109,7 +99,8 @@ class ReferralCreate(ReferralBase):
 
 
 class Referral(ReferralBase):
-    id: int
+    # not set while the referral waits in the write-behind buffer
+    id: Optional[int]
     movie_id: int
     datetime: datetime
 
@@ -129,6 +120,17 @@ class MovieRating(BaseModel):
     referral_id: str
 
 
+class MovieBatch(BaseModel):
+    referral_ids: conlist(str, min_items=1, max_items=200)
+
+
+class MovieStats(MovieRating):
+    average_ratings: float
+    by: int
+    downloads: int
+    referrals: int
+
+
 class MovieCreate(MovieBase, MovieORM):
     pass
 
@@ -159,6 +161,9 @@ class Movie(MovieReferral):
 
     @root_validator()
     def get_average_ratings(cls, values):
+        # ORM movies provide it from their rating aggregates
+        if values.get("average_ratings"):
+            return values
         ratings = values.get("ratings")
         if not ratings:
             values["average_ratings"] = AverageRating(average_ratings=0, by=0)
@@ -169,3 +174,16 @@ class Movie(MovieReferral):
             average_ratings=average, by=len(ratings)
         )
         return values
+
+
+class MovieSummary(MovieReferral):
+    # counts in place of the ratings, referrals and downloads lists
+    average_ratings: AverageRating
+    downloads: int
+    referrals: int
+
+
+class MoviePage(BaseModel):
+    movies: List[Union[MovieSummary, Movie]]
+    # sort keys of the last movie when there may be a next page
+    after: Optional[list] = None
@@ -1,10 +1,9 @@
+import json
+import base64
+
 import sqlalchemy
-import collections
-from functools import lru_cache
 from sqlalchemy import and_, func
 
-from app.models import HashableSession
-
 
 def column_windows(session, column, windowsize):
     """Return a series of WHERE clauses against
@@ -43,21 +42,42 @@ def column_windows(session, column, windowsize):
         yield int_for_range(start, end)
 
 
-@lru_cache(maxsize=1024)
-def windowed_query(q: HashableSession, column, windowsize):
+def windowed_query(q, column, windowsize):
     """ "Break a Query into windows on a given column."""
-    return list(q.filter(whereclause).order_by(column))
+    for whereclause in column_windows(q.session, column, windowsize):
+        for row in q.filter(whereclause).order_by(column):
+            yield row
+
 
+def average_rating(rating_sum, rating_count):
+    """Average score from a movie's rating aggregates"""
+    if not rating_count:
+        return 0
+    return rating_sum / rating_count
 
-def add_ratings(ratings_list):
-    counter = 0
-    for rating in ratings_list:
-        counter += rating.score
-    return counter
 
+def download_bucket_start(moment):
+    """Start of the hourly download bucket a moment falls in"""
+    return moment.replace(minute=0, second=0, microsecond=0)
 
-def get_movie_download(download_queryset):
-    movie_download = collections.Counter()
-    for instance in download_queryset:
-        movie_download[str(instance.movie_id)] += 1
-    return movie_download
+
+def encode_cursor(page: int, after=None):
+    """
+    Opaque cursor of the next page, `after` holds the sort keys of the last
+    row of the current one
+    """
+    payload = json.dumps({"page": page, "after": after}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Returns the (page, after) of a cursor, raises ValueError when invalid"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        page, after = int(payload["page"]), payload["after"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if page < 1 or not (after is None or isinstance(after, list) and len(after) == 2):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return page, after
@@ -0,0 +1,102 @@
+"""
+Shared lookup of the movie a referral id belongs to
+"""
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from app import cache
+from app.models import SessionLocal, models
+
+
+class MovieRef(NamedTuple):
+    """The parts of a movie that write paths and invalidation hooks need"""
+
+    id: int
+    engine: str
+
+
+# referral ids looked up per query by resolve_many
+LOOKUP_CHUNK = 500
+
+# bounded maps of referral ids to movie refs and of unknown referral ids
+refs = cache.named_cache("referral_ids")
+missing = cache.named_cache("missing_referral_ids")
+
+
+def resolve(db: Session, referral_id: str) -> Optional[MovieRef]:
+    """Returns the movie of a referral id, or None if there is no such movie"""
+    ref = refs.get(referral_id, None)
+    if ref is not None or missing.get(referral_id, False):
+        return ref
+    row = (
+        db.query(models.Movie.id, models.Movie.engine)
+        .filter(models.Movie.referral_id == referral_id)
+        .first()
+    )
+    if row is None:
+        missing.set(referral_id, True)
+        return None
+    ref = MovieRef(*row)
+    refs.set(referral_id, ref)
+    return ref
+
+
+def resolve_many(db: Session, referral_ids: Iterable[str]) -> Dict[str, MovieRef]:
+    """
+    Returns the movies of several referral ids, those not mapped yet are
+    looked up LOOKUP_CHUNK at a time. Unknown referral ids are left out
+    """
+    resolved = {}
+    unmapped = []
+    for referral_id in set(referral_ids):
+        ref = refs.get(referral_id, None)
+        if ref is not None:
+            resolved[referral_id] = ref
+        elif not missing.get(referral_id, False):
+            unmapped.append(referral_id)
+    for start in range(0, len(unmapped), LOOKUP_CHUNK):
+        chunk = unmapped[start : start + LOOKUP_CHUNK]
+        rows = db.query(
+            models.Movie.referral_id, models.Movie.id, models.Movie.engine
+        ).filter(models.Movie.referral_id.in_(chunk))
+        for referral_id, movie_id, engine in rows:
+            resolved[referral_id] = MovieRef(movie_id, engine)
+            refs.set(referral_id, resolved[referral_id])
+        for referral_id in chunk:
+            if referral_id not in resolved:
+                missing.set(referral_id, True)
+    return resolved
+
+
+def load(db: Session):
+    """Fills the map with the most recently created movies"""
+    rows = (
+        db.query(models.Movie.referral_id, models.Movie.id, models.Movie.engine)
+        .filter(models.Movie.referral_id.isnot(None))
+        .order_by(models.Movie.id.desc())
+        .limit(refs.maxsize)
+        .all()
+    )
+    # oldest first so the newest movies are the last to be evicted
+    for referral_id, movie_id, engine in reversed(rows):
+        refs.set(referral_id, MovieRef(movie_id, engine))
+
+
+def warm():
+    """Warms the referral id map from the movies table"""
+    db = SessionLocal()
+    try:
+        load(db)
+        logging.info(f"Referral resolver warmed with {refs.stats()['size']} movies")
+    finally:
+        db.close()
+
+
+@cache.on("movies_saved")
+def remember_saved_movies(movies: List[models.Movie]):
+    for movie in movies:
+        if movie.referral_id:
+            refs.set(movie.referral_id, MovieRef(movie.id, movie.engine))
+            missing.invalidate(movie.referral_id)
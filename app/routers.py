@@ -1,175 +1,319 @@
-import time
-from typing import List
+import secrets
+import datetime
+from typing import List, Optional, Union
 import contextlib
-import requests
-import logging
 
-from fastapi import Depends, FastAPI, HTTPException, APIRouter
+from fastapi import Depends, Header, HTTPException, APIRouter, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.settings import settings
-from app import utils
+from app import cache, circuit, export, latency, metrics, utils, writebehind
 from app.models import (
-    SessionLocal,
     schemas,
-    crud,
-    HashableSession,
-    HashableParams,
+    async_crud,
+    get_async_db,
     get_db,
+    pool,
 )
+from app.models.utils import decode_cursor, encode_cursor
 
 router = APIRouter()
 
+# sessions of the async engine when it is enabled, else threadpool sessions
+get_session = get_async_db if settings.async_database else get_db
+
+
+def require_internal_token(x_internal_token: Optional[str] = Header(None)):
+    """
+    Rejects requests to internal routes without the configured internal token
+    """
+    if not settings.internal_token:
+        raise HTTPException(status_code=403, detail="Internal routes are disabled")
+    if x_internal_token is None or not secrets.compare_digest(
+        x_internal_token, settings.internal_token
+    ):
+        raise HTTPException(status_code=401, detail="Invalid internal token")
+
 
 @router.post("/movie/ratings/average/", response_model=schemas.AverageRating)
-def get_average_ratings(movie: schemas.MovieRating, db: Session = Depends(get_db)):
+async def get_average_ratings(
+    movie: schemas.MovieRating, db: Session = Depends(get_session)
+):
     """
     Get average movie ratings and number of people who have rated
     """
-    return crud.get_movie_average_ratings(db=db, movie=movie)
+    return await async_crud.get_movie_average_ratings(db=db, movie=movie)
 
 
 @router.post("/movie/rating/", response_model=schemas.Rating)
-def get_ip_rating(spec_rating: schemas.SpecificRating, db: Session = Depends(get_db)):
+async def get_ip_rating(
+    spec_rating: schemas.SpecificRating, db: Session = Depends(get_session)
+):
     """
     Get Rating of a movie by an ip_address
     """
-    return crud.get_rating(db=db, spec_rating=spec_rating)
+    return await async_crud.get_rating(db=db, spec_rating=spec_rating)
 
 
 @router.post("/movie/downloads/", response_model=int)
-def get_downloads(movie: schemas.MovieRating, db: Session = Depends(get_db)):
+async def get_downloads(movie: schemas.MovieRating, db: Session = Depends(get_session)):
     """
     Gets number of downloads of a movie
     """
-    return crud.get_number_of_downloads(db=db, movie=movie)
+    return await async_crud.get_number_of_downloads(db=db, movie=movie)
 
 
 @router.post("/movie/referrals/", response_model=int)
-def get_referrals(movie: schemas.MovieRating, db: Session = Depends(get_db)):
+async def get_referrals(movie: schemas.MovieRating, db: Session = Depends(get_session)):
     """
     Gets total number of referrals of a movie
     """
-    return crud.get_no_of_referrals(db=db, movie=movie)
+    return await async_crud.get_no_of_referrals(db=db, movie=movie)
+
+
+@router.post("/movies/stats/", response_model=List[schemas.MovieStats])
+async def get_movies_stats(
+    batch: schemas.MovieBatch, db: Session = Depends(get_session)
+):
+    """
+    Gets average ratings, number of raters, downloads and referrals of
+    several movies at once
+    """
+    return await async_crud.get_movies_stats(db=db, batch=batch)
 
 
 @router.post("/rate/", response_model=schemas.Rating)
-def create_or_update_rating(
-    spec_rating: schemas.SpecificRatingScore, db: Session = Depends(get_db)
+async def create_or_update_rating(
+    spec_rating: schemas.SpecificRatingScore, db: Session = Depends(get_session)
 ):
     """
     Create or update a movie rating by an ip_address
     """
-    return crud.create_or_update_rating(db=db, spec_rating=spec_rating)
+    return await async_crud.create_or_update_rating(db=db, spec_rating=spec_rating)
 
 
 @router.post("/referral/", response_model=schemas.Referral)
-def refer_to_movie(referral: schemas.ReferralCreate, db: Session = Depends(get_db)):
+async def refer_to_movie(
+    referral: schemas.ReferralCreate, db: Session = Depends(get_session)
+):
     """
     Create a referral object for a movie and return referral id
     """
-    return crud.create_referral(db=db, referral=referral)
+    return await async_crud.create_referral(db=db, referral=referral)
 
 
 @router.post("/referral/id/", response_model=schemas.MovieReferral)
-def get_referral_by_id(referral_id: str, db: HashableSession = Depends(get_db)):
+async def get_referral_by_id(referral_id: str, db: Session = Depends(get_session)):
     """
     Get movie object by referral id
     """
-    return crud.get_movie_by_referral_id(db=db, referral_id=referral_id)
+    return await async_crud.get_movie_by_referral_id(db=db, referral_id=referral_id)
 
 
 @router.post("/download/", response_model=schemas.Download)
-def download_movie(download: schemas.DownloadCreate, db: Session = Depends(get_db)):
+async def download_movie(
+    download: schemas.DownloadCreate, db: Session = Depends(get_session)
+):
     """
     Create a download object for a movie by ip_address
     """
-    return crud.create_download(db=db, download=download)
+    return await async_crud.create_download(db=db, download=download)
 
 
 @router.post("/download/highest/", response_model=List[schemas.MovieDownloads])
-def filter_highest_downloads(
-    filter_: schemas.DownloadFilter, db: HashableSession = Depends(get_db)
+async def filter_highest_downloads(
+    filter_: schemas.DownloadFilter, db: Session = Depends(get_session)
 ):
     """
     Get the most downloaded movies in a period
     """
-    highest = crud.get_highest_downloads(db=db, filter_=filter_)
-    print(
-        crud.get_highest_downloads.cache_info(),
-        print(db.__hash__(), filter_.__hash__()),
-    )
-    return highest
+    return await async_crud.get_highest_downloads(db=db, filter_=filter_)
 
 
 @router.post("/movie/", response_model=schemas.Movie)
-def get_movie_by_schema(movie: schemas.MovieBase, db: Session = Depends(get_db)):
+async def get_movie_by_schema(
+    movie: schemas.MovieBase, db: Session = Depends(get_session)
+):
     """
     Return full schema of a movie
     """
-    return crud.get_movie_by_schema(db=db, movie=movie).first()
+    return await async_crud.get_movie_by_schema(db=db, movie=movie)
 
 
 @router.post("/rating/", response_model=List[schemas.Rating])
-def get_ratings(movie: schemas.MovieRating, db: Session = Depends(get_db)):
+async def get_ratings(movie: schemas.MovieRating, db: Session = Depends(get_session)):
     """
     Retrieves all the rating objects of a movie
     """
-    return crud.get_movie_ratings(db=db, movie=movie)
+    return await async_crud.get_movie_ratings(db=db, movie=movie)
+
 
+def read_cursor(cursor: str):
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
-@router.get("/list/", response_model=List[schemas.Movie])
-def list_movies(
+
+@router.get(
+    "/list/",
+    response_model=Union[List[schemas.MovieSummary], List[schemas.Movie]],
+)
+async def list_movies(
+    response: Response,
     engine: str = "netnaija",
     page: int = 1,
     num: int = 20,
-    db: HashableSession = Depends(get_db),
+    cursor: Optional[str] = None,
+    full: bool = False,
+    db: Session = Depends(get_session),
 ):
     """
-    Lists movies from an engine
+    Lists movies from an engine, the cursor of the next page is returned in
+    the X-Next-Cursor header
 
     engine: the engine to list data from
     page: the page number
     num: the number of results to return per page
+    cursor: the X-Next-Cursor of the previous page, used in place of page
+    full: include the ratings, referrals and downloads of each movie instead
+    of their counts
     """
-    params = HashableParams({"num": num, "engine": engine, "page": page})
+    after = None
+    if cursor:
+        page, after = read_cursor(cursor)
+    params = {"num": num, "engine": engine, "page": page}
     movies = []
     with contextlib.suppress(utils.GophieHostException):
-        movies = utils.get_movies_from_remote(
-            f"{settings.gophie_host}/list", params, engine, db
+        movies = await utils.get_movies_from_remote(
+            f"{settings.gophie_host}/list", params, engine
         )
-    if not movies:
-        movies = crud.list_movies(db=db, engine=engine, page=page, num=num)
-        logging.info(utils.get_movies_from_remote.cache_info())
-    return movies
+    if movies:
+        response.headers["X-Next-Cursor"] = encode_cursor(page + 1)
+        return await async_crud.movie_schemas(db, movies, full)
+    try:
+        movie_page = await async_crud.list_movies(
+            db=db, engine=engine, page=page, num=num, after=after, full=full
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if movie_page.after:
+        response.headers["X-Next-Cursor"] = encode_cursor(page + 1, movie_page.after)
+    return movie_page.movies
 
 
-@router.get("/search/", response_model=List[schemas.Movie])
-def search_movies(
+@router.get(
+    "/search/",
+    response_model=Union[List[schemas.MovieSummary], List[schemas.Movie]],
+)
+async def search_movies(
+    response: Response,
     engine: str = "netnaija",
     query: str = "hello",
     page: int = 1,
     num: int = 20,
-    db: HashableSession = Depends(get_db),
+    cursor: Optional[str] = None,
+    full: bool = False,
+    db: Session = Depends(get_session),
 ):
     """
-    Searches movies from an engine using partial ratio
+    Searches movies from an engine using partial ratio, the cursor of the
+    next page is returned in the X-Next-Cursor header
 
     engine: the engine to list data from
     query: the search term urlencoded
+    cursor: the X-Next-Cursor of the previous page, used in place of page
+    full: include the ratings, referrals and downloads of each movie instead
+    of their counts
     """
-    params = HashableParams({"query": query, "engine": engine, "page": page})
+    after = None
+    if cursor:
+        page, after = read_cursor(cursor)
+    params = {"query": query, "engine": engine, "page": page}
     movies = []
     with contextlib.suppress(utils.GophieHostException):
-        start = time.time()
-        movies = utils.get_movies_from_remote(
-            f"{settings.gophie_host}/search", params, engine, db
+        movies = await utils.get_movies_from_remote(
+            f"{settings.gophie_host}/search", params, engine
         )
-        if movies:
-            print("Time elapsed Running Search: ", time.time() - start)
-    if not movies:
-        movies = crud.search_movies(
-            db=db, engine=engine, query=query, page=page, num=num
+    if movies:
+        response.headers["X-Next-Cursor"] = encode_cursor(page + 1)
+        return await async_crud.movie_schemas(db, movies, full)
+    try:
+        movie_page = await async_crud.search_movies(
+            db=db,
+            engine=engine,
+            query=query,
+            page=page,
+            num=num,
+            after=after,
+            full=full,
         )
-        logging.info(utils.get_movies_from_remote.cache_info())
-    return movies
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if movie_page.after:
+        response.headers["X-Next-Cursor"] = encode_cursor(page + 1, movie_page.after)
+    return movie_page.movies
+
+
+@router.get(
+    "/export/{kind}/",
+    include_in_schema=False,
+    dependencies=[Depends(require_internal_token)],
+)
+async def export_events(
+    kind: str,
+    format: str = "ndjson",
+    engine: Optional[str] = None,
+    since: Optional[datetime.datetime] = None,
+    until: Optional[datetime.datetime] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Streams every rating, download or referral as NDJSON or CSV
+
+    kind: ratings, downloads or referrals
+    format: ndjson or csv
+    engine: only export events of this engine's movies
+    since, until: only export downloads or referrals in this time range
+    """
+    if kind not in export.EVENTS:
+        raise HTTPException(status_code=404, detail=f"Unknown export {kind}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format {format}")
+    try:
+        query = export.query_events(db, kind, engine, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # the sync session is read from the threadpool while the response streams
+    return StreamingResponse(
+        export.stream(query, format), media_type=export.FORMATS[format]
+    )
+
+
+@router.get(
+    "/internal/stats/",
+    include_in_schema=False,
+    dependencies=[Depends(require_internal_token)],
+)
+async def internal_stats():
+    """
+    Connection pool, cache, Gophie latency and circuit breaker, and
+    write-behind buffer stats of this worker
+    """
+    return {
+        "pools": pool.stats(),
+        "caches": cache.stats(),
+        "gophie_latency": latency.stats(),
+        "gophie_circuits": circuit.stats(),
+        "write_behind": writebehind.buffer.stats(),
+    }
+
+
+@router.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Request, upstream, database and cache metrics of this worker in the
+    Prometheus text format
+    """
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
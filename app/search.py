@@ -0,0 +1,192 @@
+"""
+Pluggable movie name search backends
+"""
+import logging
+
+from sqlalchemy import Float, Integer, cast, func, text, tuple_
+from sqlalchemy.dialects.postgresql import REAL
+from sqlalchemy.orm import Session
+
+from app import fuzzy
+from app.settings import settings
+from app.models import models
+
+# Queries shorter than this cannot use trigram indexes
+MIN_TRIGRAM_QUERY = 3
+
+class LikeSearch:
+    """Unindexed substring search, works everywhere"""
+
+    name = "like"
+
+    def search(
+        self, db: Session, engine: str, query: str, page: int, num: int, after=None
+    ):
+        movies = (
+            db.query(models.Movie)
+            .filter(
+                models.Movie.name.ilike("%" + query + "%"),
+                func.lower(models.Movie.engine) == engine.lower(),
+            )
+            .order_by(models.Movie.id)
+        )
+        if after:
+            # unranked, the keyset is (0, id)
+            movies = movies.filter(models.Movie.id > int(after[1]))
+        else:
+            movies = movies.offset(num * (page - 1))
+        return [(0, movie) for movie in movies.limit(num)]
+
+
+class TrigramSearch:
+    """
+    PostgreSQL pg_trgm search, substring and fuzzy matches both use the GIN
+    trigram index and are ranked by word similarity
+    """
+
+    name = "trigram"
+
+    def search(
+        self, db: Session, engine: str, query: str, page: int, num: int, after=None
+    ):
+        if len(query) < MIN_TRIGRAM_QUERY:
+            return LikeSearch().search(db, engine, query, page, num, after)
+        rank = func.word_similarity(query, models.Movie.name)
+        movies = (
+            db.query(rank, models.Movie)
+            .filter(
+                models.Movie.name.ilike("%" + query + "%")
+                | models.Movie.name.op("%>")(query),
+                func.lower(models.Movie.engine) == engine.lower(),
+            )
+            .order_by(rank.desc(), models.Movie.id)
+        )
+        if after:
+            # word_similarity is a real, compare it as one so ties match
+            last_rank = cast(after[0], REAL)
+            movies = movies.filter(
+                (rank < last_rank)
+                | ((rank == last_rank) & (models.Movie.id > int(after[1])))
+            )
+        else:
+            movies = movies.offset(num * (page - 1))
+        return movies.limit(num).all()
+
+
+class FTS5Search:
+    """SQLite FTS5 trigram search ranked by bm25"""
+
+    name = "fts5"
+
+    def search(
+        self, db: Session, engine: str, query: str, page: int, num: int, after=None
+    ):
+        if len(query) < MIN_TRIGRAM_QUERY:
+            return LikeSearch().search(db, engine, query, page, num, after)
+        matches = (
+            text(
+                "SELECT rowid AS id, rank FROM movies_fts "
+                "WHERE movies_fts MATCH :query"
+            )
+            .bindparams(query=fts5_phrase(query))
+            .columns(id=Integer, rank=Float)
+            .subquery("matches")
+        )
+        movies = (
+            db.query(matches.c.rank, models.Movie)
+            .join(matches, models.Movie.id == matches.c.id)
+            .filter(func.lower(models.Movie.engine) == engine.lower())
+            .order_by(matches.c.rank, models.Movie.id)
+        )
+        if after:
+            movies = movies.filter(
+                tuple_(matches.c.rank, models.Movie.id)
+                > tuple_(float(after[0]), int(after[1]))
+            )
+        else:
+            movies = movies.offset(num * (page - 1))
+        return movies.limit(num).all()
+
+
+class NgramSearch:
+    """
+    In-process trigram index search ranked by partial ratio, the database
+    backend is used until the index is built
+    """
+
+    name = "ngram"
+
+    def search(
+        self, db: Session, engine: str, query: str, page: int, num: int, after=None
+    ):
+        if not fuzzy.index.ready:
+            return get_database_backend(db).search(
+                db, engine, query, page, num, after
+            )
+        ranking = fuzzy.index.search(
+            engine,
+            query,
+            limit=num,
+            offset=0 if after else num * (page - 1),
+            after=(float(after[0]), int(after[1])) if after else None,
+        )
+        movies = {
+            movie.id: movie
+            for movie in db.query(models.Movie).filter(
+                models.Movie.id.in_([movie_id for _, movie_id in ranking])
+            )
+        }
+        return [
+            (rank, movies[movie_id]) for rank, movie_id in ranking if movie_id in movies
+        ]
+
+
+def fts5_phrase(query: str):
+    """Quotes a user query as a single FTS5 phrase"""
+    return '"' + query.replace('"', '""') + '"'
+
+
+backends = {
+    backend.name: backend
+    for backend in (LikeSearch(), TrigramSearch(), FTS5Search(), NgramSearch())
+}
+# auto detected backend of each engine
+_detected = {}
+
+
+def get_backend(db: Session):
+    """
+    Returns the configured search backend, `auto` picks the in-process index
+    when it is enabled, else the indexed backend of the database
+    """
+    if settings.search_backend != "auto":
+        return backends[settings.search_backend]
+    if settings.fuzzy_index_enabled and fuzzy.index.ready:
+        return backends["ngram"]
+    return get_database_backend(db)
+
+
+def get_database_backend(db: Session):
+    """
+    Returns the indexed backend of the database when its index exists
+    """
+    bind = db.get_bind()
+    if bind not in _detected:
+        _detected[bind] = detect_backend(db)
+        logging.info(f"Using {_detected[bind].name} search for {bind.url}")
+    return _detected[bind]
+
+
+def detect_backend(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        installed = db.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        ).first()
+        return backends["trigram"] if installed else backends["like"]
+    if dialect == "sqlite":
+        exists = db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'movies_fts'")
+        ).first()
+        return backends["fts5"] if exists else backends["like"]
+    return backends["like"]
@@ -1,5 +1,5 @@
 import os
-from typing import List
+from typing import Dict, List
 
 from fastapi import FastAPI
 from pydantic import BaseSettings
@@ -12,8 +12,107 @@ class Settings(BaseSettings):
     app_name: str = "Ocena"
     gophie_host: str = "https://gophie.cam"
     gophie_access_key: str = ""
+    # sent as X-Internal-Token to internal routes, they refuse every
+    # request while it is unset
+    internal_token: str = ""
     database_url: str = f"sqlite:///{BASE_DIR}/db.sqlite3"
     debug: bool = True
+    # serve requests with asyncpg or aiosqlite sessions instead of threadpool
+    # workers, background jobs keep using the sync engine
+    async_database: bool = False
+    # Database connection pool of each uvicorn worker, keep
+    # workers * (db_pool_size + db_max_overflow) below max_connections
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # rows fetched per server-side cursor batch by exports
+    export_batch_size: int = 1000
+
+    # Gophie HTTP client, gophie_timeout is the longest wait for an engine
+    # and gophie_timeouts overrides it per engine
+    gophie_timeout: float = 20
+    gophie_timeouts: Dict[str, float] = {}
+    gophie_pool_size: int = 100
+    gophie_max_keepalive: int = 20
+    gophie_keepalive_expiry: float = 30
+    gophie_engine_concurrency: int = 10
+    # Per engine circuit breaker, opened by consecutive failures or slow
+    # responses. While open, requests fall back to stored movies, after
+    # gophie_breaker_open_seconds probe requests decide whether it closes
+    gophie_breaker_failures: int = 5
+    gophie_breaker_slow_seconds: float = 5
+    gophie_breaker_open_seconds: float = 30
+    gophie_breaker_probes: int = 1
+    # Adaptive timeouts, the p99 of an engine's latest gophie_latency_window
+    # responses times gophie_timeout_multiplier, at least gophie_min_timeout.
+    # Hedging sends a second request when the first has not answered by the
+    # engine's gophie_hedge_percentile latency. Both are overridden per engine
+    gophie_latency_window: int = 200
+    gophie_latency_min_samples: int = 20
+    gophie_adaptive_timeout: bool = True
+    gophie_adaptive_timeouts: Dict[str, bool] = {}
+    gophie_timeout_multiplier: float = 2
+    gophie_min_timeout: float = 1
+    gophie_hedge: bool = False
+    gophie_hedges: Dict[str, bool] = {}
+    gophie_hedge_percentile: float = 95
+
+    # Caches, TTLs are in seconds and keyed by the cached function's name
+    cache_default_ttl: float = 300
+    cache_default_maxsize: int = 1024
+    cache_ttls: Dict[str, float] = {
+        "list_movies": 300,
+        "search_movies": 300,
+        "get_movie_by_referral_id": 3600,
+        "get_highest_downloads": 60,
+        # referral ids never move to another movie, unknown ones may be
+        # created by another worker
+        "referral_ids": 24 * 3600,
+        "missing_referral_ids": 30,
+    }
+    cache_maxsizes: Dict[str, int] = {
+        "get_movies_from_remote": 4096,
+        "list_movies": 4096,
+        "search_movies": 4096,
+        "get_movie_by_referral_id": 256,
+        "get_highest_downloads": 128,
+        "referral_ids": 65536,
+        "missing_referral_ids": 4096,
+    }
+
+    # Gophie listings and searches are served fresh for the soft TTL, then
+    # stale while they are refreshed in the background until the hard TTL.
+    # Keyed by engine, a failed refresh is retried after remote_refresh_retry
+    remote_soft_ttl: float = 300
+    remote_hard_ttl: float = 24 * 3600
+    remote_soft_ttls: Dict[str, float] = {}
+    remote_hard_ttls: Dict[str, float] = {}
+    remote_refresh_retry: float = 30
+
+    # In-process trending downloads, memory is bounded by
+    # trending_retention_hours * trending_bucket_capacity counters
+    trending_enabled: bool = True
+    trending_retention_hours: int = 24 * 7 * 4
+    trending_bucket_capacity: int = 256
+    trending_refresh_seconds: float = 5
+    trending_resync_seconds: float = 300
+
+    # Movie search backend: auto, ngram (in-process), trigram (PostgreSQL),
+    # fts5 (SQLite) or like
+    search_backend: str = "auto"
+    fuzzy_index_enabled: bool = True
+    # share of the query's trigrams a name must contain to match
+    fuzzy_min_similarity: float = 0.5
+    fuzzy_resync_seconds: float = 300
+
+    # Write-behind buffering of downloads and referrals
+    write_behind_enabled: bool = False
+    write_behind_max_events: int = 10000
+    write_behind_batch_size: int = 500
+    write_behind_flush_ms: int = 200
+    write_behind_put_timeout: float = 0.05
 
 
 settings = Settings()
@@ -0,0 +1,165 @@
+"""
+In-process sliding window ranking of the most downloaded movies
+"""
+import time
+import heapq
+import asyncio
+import logging
+import datetime
+import threading
+import collections
+from operator import itemgetter
+
+from starlette.concurrency import run_in_threadpool
+
+from app import cache, resolver
+from app.settings import settings
+from app.models import SessionLocal, models
+
+EPOCH = datetime.datetime(1970, 1, 1)
+BUCKET = datetime.timedelta(hours=1)
+
+
+def bucket_number(moment: datetime.datetime):
+    """Index of the hourly bucket a naive UTC datetime falls in"""
+    return int((moment - EPOCH) // BUCKET)
+
+
+class SpaceSaving:
+    """
+    Space-Saving summary that tracks at most `capacity` heavy hitters.
+    A new key replaces the smallest counter and inherits its count, so
+    counts are overestimated by at most that count
+    """
+
+    __slots__ = ("capacity", "counts")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, key, count=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif len(counts) < self.capacity:
+            counts[key] = count
+        else:
+            smallest = min(counts, key=counts.__getitem__)
+            counts[key] = counts.pop(smallest) + count
+
+
+class TrendingDownloads:
+    """
+    Ring buffer of hourly Space-Saving summaries covering the last
+    `retention_hours` hours. Memory is bounded by retention_hours * capacity
+    counters however many distinct movies are downloaded, and merged
+    rankings are memoized for `refresh_seconds`
+    """
+
+    def __init__(self, retention_hours: int, capacity: int, refresh_seconds: float):
+        self.retention_hours = retention_hours
+        self.capacity = capacity
+        self.refresh_seconds = refresh_seconds
+        self.ready = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._buckets = [None] * self.retention_hours
+        self._bucket_numbers = [-1] * self.retention_hours
+        self._rankings = {}
+
+    def covers(self, window: datetime.timedelta):
+        return self.ready and window <= BUCKET * (self.retention_hours - 1)
+
+    def record(self, movie_id: int, moment: datetime.datetime, count: int = 1):
+        number = bucket_number(moment)
+        slot = number % self.retention_hours
+        with self._lock:
+            if self._bucket_numbers[slot] != number:
+                if self._bucket_numbers[slot] > number:
+                    # older than the retention period
+                    return
+                self._buckets[slot] = SpaceSaving(self.capacity)
+                self._bucket_numbers[slot] = number
+            self._buckets[slot].add(movie_id, count)
+
+    def top(self, window: datetime.timedelta, k: int):
+        """
+        Returns up to k (movie_id, downloads) pairs for the last `window`,
+        accurate to the hour
+        """
+        now = datetime.datetime.utcnow()
+        first, last = bucket_number(now - window), bucket_number(now)
+        memo_key = (first, last, k)
+        ranking = self._rankings.get(memo_key)
+        if ranking and time.monotonic() - ranking[0] < self.refresh_seconds:
+            return ranking[1]
+
+        totals = collections.Counter()
+        with self._lock:
+            for number in range(first, last + 1):
+                slot = number % self.retention_hours
+                if self._bucket_numbers[slot] == number:
+                    totals.update(self._buckets[slot].counts)
+        result = heapq.nlargest(k, totals.items(), key=itemgetter(1))
+        self._rankings[memo_key] = (time.monotonic(), result)
+        return result
+
+    def load(self, db):
+        """
+        Replaces the counters with the download buckets stored in the
+        database, which include the downloads of every worker
+        """
+        since = datetime.datetime.utcnow() - BUCKET * self.retention_hours
+        buckets = (
+            db.query(models.DownloadBucket)
+            .filter(models.DownloadBucket.bucket_start >= since)
+            .yield_per(10000)
+        )
+        loaded = TrendingDownloads(
+            self.retention_hours, self.capacity, self.refresh_seconds
+        )
+        for bucket in buckets:
+            loaded.record(bucket.movie_id, bucket.bucket_start, bucket.count)
+        with self._lock:
+            self._buckets = loaded._buckets
+            self._bucket_numbers = loaded._bucket_numbers
+            self._rankings = {}
+        self.ready = True
+
+
+downloads = TrendingDownloads(
+    retention_hours=settings.trending_retention_hours,
+    capacity=settings.trending_bucket_capacity,
+    refresh_seconds=settings.trending_refresh_seconds,
+)
+
+
+def bootstrap():
+    """Loads the trending counters from the download buckets table"""
+    db = SessionLocal()
+    try:
+        downloads.load(db)
+    finally:
+        db.close()
+
+
+async def resync_forever():
+    """
+    Reloads the counters periodically so downloads recorded by other
+    workers are picked up
+    """
+    while True:
+        try:
+            await run_in_threadpool(bootstrap)
+        except Exception:
+            logging.exception("Could not load trending downloads")
+        await asyncio.sleep(settings.trending_resync_seconds)
+
+
+@cache.on("download_created")
+def record_download(movie: resolver.MovieRef, downloaded_at: datetime.datetime):
+    if downloads.ready:
+        downloads.record(movie.id, downloaded_at)
@@ -1,23 +1,31 @@
 import time
 import os
-import requests
+import asyncio
 import uuid
 import re
 import logging
-from functools import lru_cache
 from datetime import datetime, timedelta
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+from typing import Dict, Optional
 
+import httpx
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app import cache, circuit, latency, metrics
 from app.settings import settings
-from app.models import HashableSession, HashableParams
-from app.models import models, crud
+from app.models import SessionLocal, models, schemas, crud
 
 
 # Pattern for converting camel to snake case, used in parsing json response
 camel_to_snake_pattern = re.compile(r"(?<!^)(?=[A-Z])")
 
 
+# Shared upstream client, see get_gophie_client
+_gophie_client: Optional[httpx.AsyncClient] = None
+_engine_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
 class GophieHostException(Exception):
     """Generic Gophie Host Exception"""
 
@@ -36,6 +44,12 @@ class GophieUnresponsive(Exception):
     pass
 
 
+class GophieCircuitOpen(GophieHostException):
+    """If requests to an engine are not made as it keeps failing"""
+
+    pass
+
+
 def camel_case_to_snake_case(s):
     return camel_to_snake_pattern.sub("_", s).lower()
 
@@ -48,7 +62,7 @@ def keys_to_snake_case(d):
     return new_dict
 
 
-def dict_to_model(params: HashableParams, movie_dict: dict):
+def dict_to_model(params: dict, movie_dict: dict):
     """converts a movie_dict to model"""
     update = {
         "engine": movie_dict["source"],
@@ -72,20 +86,120 @@ def dict_to_model(params: HashableParams, movie_dict: dict):
     return models.Movie(**movie_dict)
 
 
-@lru_cache(maxsize=4096)
-def get_movies_from_remote(
-    url: str, params: HashableParams, engine: str, db: HashableSession
-):
-    """Gets movies from remote url"""
-    movies = []
-    adapter = HTTPAdapter(max_retries=1)
-    http = requests.Session()
-    http.mount("https://", adapter)
-    http.mount("http://", adapter)
+def get_gophie_client() -> httpx.AsyncClient:
+    """
+    Returns the shared Gophie client, creating it if the app has not started one
+    """
+    global _gophie_client
+    if _gophie_client is None or _gophie_client.is_closed:
+        limits = httpx.Limits(
+            max_connections=settings.gophie_pool_size,
+            max_keepalive_connections=settings.gophie_max_keepalive,
+            keepalive_expiry=settings.gophie_keepalive_expiry,
+        )
+        _gophie_client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(retries=1, limits=limits),
+            headers={"Authorization": f"Bearer {settings.gophie_access_key}"},
+            timeout=settings.gophie_timeout,
+        )
+    return _gophie_client
+
+
+async def close_gophie_client():
+    """Closes the shared Gophie client and its pooled connections"""
+    global _gophie_client
+    if _gophie_client is not None:
+        await _gophie_client.aclose()
+        _gophie_client = None
+
+
+def get_engine_semaphore(engine: str) -> asyncio.Semaphore:
+    """Limits the number of concurrent upstream requests made for an engine"""
+    key = engine.lower()
+    if key not in _engine_semaphores:
+        _engine_semaphores[key] = asyncio.Semaphore(settings.gophie_engine_concurrency)
+    return _engine_semaphores[key]
+
+
+async def timed_get(url: str, params: dict, engine: str, timeout: float):
+    """
+    GETs url, recording the latency of non-5xx responses. Timeouts and
+    cancelled hedges record how long they waited, so a slowing engine
+    raises its percentiles instead of timing out forever
+    """
+    tracker = latency.tracker(engine)
+    start = time.perf_counter()
+    try:
+        response = await get_gophie_client().get(url, params=params, timeout=timeout)
+    except (httpx.TimeoutException, asyncio.CancelledError):
+        tracker.record(time.perf_counter() - start)
+        raise
+    if response.status_code < 500:
+        tracker.record(time.perf_counter() - start)
+    return response
+
+
+async def get_from_gophie(url: str, params: dict, engine: str):
+    """
+    GETs url within the engine's adaptive timeout. A hedged engine gets a
+    second request if the first has not answered after its hedge delay and
+    one of the engine's concurrency permits is free, the first response of
+    either is used. The caller holds the first request's permit
+    """
+    timeout = latency.timeout(engine)
+    delay = latency.hedge_delay(engine)
+    first = asyncio.ensure_future(timed_get(url, params, engine, timeout))
+    if delay is None or delay >= timeout:
+        return await first
+    pending = {first}
     try:
-        headers = {"Authorization": f"Bearer {settings.gophie_access_key}"}
-        start = time.time()
-        response = http.get(url, params=params, headers=headers, timeout=20)
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        semaphore = get_engine_semaphore(engine)
+        if not done and not semaphore.locked():
+            await semaphore.acquire()
+            metrics.gophie_hedges.inc(engine=engine.lower())
+            hedge = asyncio.ensure_future(
+                timed_get(url, params, engine, timeout - delay)
+            )
+            # released however the hedge ends, even if cancelled unstarted
+            hedge.add_done_callback(lambda _: semaphore.release())
+            pending.add(hedge)
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+            if not pending:
+                # both attempts failed
+                return first.result()
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def fetch_movies_from_remote(url: str, params: dict, engine: str):
+    """
+    Gets the raw movie list of an engine from remote url, failing fast while
+    the engine's circuit is open
+    """
+    breaker = circuit.breaker(engine)
+    generation = breaker.allow()
+    if generation is None:
+        raise GophieCircuitOpen(f"Circuit of {engine} is {breaker.state}")
+    status, elapsed = "error", 0.0
+    try:
+        async with get_engine_semaphore(engine):
+            start = time.perf_counter()
+            try:
+                response = await get_from_gophie(url, params, engine)
+                status = response.status_code
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.gophie_latency.observe(
+                    elapsed, engine=engine.lower(), status=status
+                )
         if response.status_code != 200:
             raise GophieUnresponsive(
                 f"Invalid Response from {settings.gophie_host} for <{engine}: ({response.status_code}): {response.content}"
@@ -94,18 +208,67 @@ def get_movies_from_remote(
             raise InvalidResponse(
                 f"Empty Response from {settings.gophie_host} for {engine}: {response.content}"
             )
-        print("time elapsed: ", time.time() - start)
     except Exception as e:
         logging.error(str(e))
         raise GophieHostException(
             f"Invalid Response from {settings.gophie_host}: {str(e)}"
         )
-    else:
-        for m in response.json():
-            movie = keys_to_snake_case(m)
-            if movie.get("title", None) and movie.get("source", None):
-                movie_model = dict_to_model(params, movie)
-                cleaned_movie = crud.create_movie(db, movie_model)
-                # cleaned_movie["ratings"] = crud.get_movie_average_ratings(db=db, movie=cleaned_movie)
-                movies.append(cleaned_movie)
-    return movies
+    finally:
+        # a responding engine is healthy even if it has no such page
+        breaker.record(generation, status != "error" and status < 500, elapsed)
+    return response.json()
+
+
+def save_movies(db: Session, params: dict, movie_list: list):
+    """
+    Persists a raw movie list from remote and returns the saved movies,
+    without their ratings and counts
+    """
+    movie_models = []
+    for m in movie_list:
+        movie = keys_to_snake_case(m)
+        if movie.get("title", None) and movie.get("source", None):
+            movie_models.append(dict_to_model(params, movie))
+    movies = crud.upsert_movies(db, movie_models)
+    return [schemas.MovieReferral.from_orm(movie) for movie in movies]
+
+
+def remote_ttls(url: str, params: dict, engine: str):
+    """Soft and hard TTLs of an engine's cached upstream pages"""
+    key = engine.lower()
+    return (
+        settings.remote_soft_ttls.get(key, settings.remote_soft_ttl),
+        settings.remote_hard_ttls.get(key, settings.remote_hard_ttl),
+    )
+
+
+def save_remote_movies(params: dict, movie_list: list):
+    """
+    Saves upstream movies with a session of its own, as the call that
+    fetched them is shared by several requests or runs in the background
+    """
+    db = SessionLocal()
+    try:
+        return save_movies(db, params, movie_list)
+    finally:
+        db.close()
+
+
+@cache.stale_while_revalidate(
+    "get_movies_from_remote",
+    key=lambda url, params, engine: (
+        engine.lower(),
+        url,
+        tuple(sorted(params.items())),
+    ),
+    ttls=remote_ttls,
+    retry_after=settings.remote_refresh_retry,
+)
+async def get_movies_from_remote(url: str, params: dict, engine: str):
+    """
+    Gets movies from remote url. Only the movies are cached, their ratings
+    and counts are read per request with crud.movie_schemas so writes never
+    make Gophie pages stale
+    """
+    movie_list = await fetch_movies_from_remote(url, params, engine)
+    return await run_in_threadpool(save_remote_movies, params, movie_list)
@@ -0,0 +1,189 @@
+"""
+Write-behind buffering of append-only tracking events
+"""
+import time
+import queue
+import asyncio
+import contextlib
+import logging
+import threading
+import collections
+from typing import Callable, Dict
+
+from app.settings import settings
+from app.models import SessionLocal
+
+_writers: Dict[str, Callable] = {}
+
+
+def writer(kind: str):
+    """
+    Registers the decorated function as the batch writer of an event kind,
+    it is called as writer(db, rows) and must not commit. It may return a
+    function that is called once the rows are committed
+    """
+
+    def decorator(func):
+        _writers[kind] = func
+        return func
+
+    return decorator
+
+
+def on_event_loop():
+    """Whether the caller runs on a thread with a running event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class WriteBehindBuffer:
+    """
+    Bounded queue of events written by a background thread every
+    `flush_interval` seconds or `batch_size` events, whichever comes first
+    """
+
+    def __init__(
+        self,
+        max_events: int,
+        batch_size: int,
+        flush_interval: float,
+        put_timeout: float,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.flushes = 0
+        self.flushed = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self._queue = queue.Queue(maxsize=max_events)
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops the flusher and writes every event still queued"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        with contextlib.suppress(queue.Full):
+            # wakes the flusher up if it is waiting on an empty queue
+            self._queue.put_nowait(None)
+        self._thread.join()
+        self._thread = None
+        while not self._queue.empty():
+            self.flush(self._take(self.batch_size, deadline=0))
+
+    def put(self, kind: str, row: dict):
+        """
+        Queues an event, returns False when the caller must write it itself
+        because the flusher is not running or the queue stayed full. Calls
+        made on the event loop thread, such as async crud calls, never wait
+        """
+        if not self.running:
+            return False
+        try:
+            if on_event_loop():
+                self._queue.put_nowait((kind, row))
+            else:
+                self._queue.put((kind, row), timeout=self.put_timeout)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        return True
+
+    def _take(self, size: int, deadline: float):
+        """Takes up to `size` events, waiting for them until `deadline`"""
+        events = []
+        while len(events) < size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    event = self._queue.get(timeout=timeout)
+                else:
+                    event = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is None:
+                break
+            events.append(event)
+        return events
+
+    def _run(self):
+        while not self._stopping.is_set():
+            events = self._take(
+                self.batch_size, deadline=time.monotonic() + self.flush_interval
+            )
+            if events:
+                self.flush(events)
+
+    def flush(self, events):
+        if not events:
+            return
+        rows = collections.defaultdict(list)
+        for kind, row in events:
+            rows[kind].append(row)
+        start = time.monotonic()
+        for attempt in (1, 2):
+            db = SessionLocal()
+            try:
+                committed = [
+                    _writers[kind](db, kind_rows) for kind, kind_rows in rows.items()
+                ]
+                db.commit()
+                break
+            except Exception:
+                db.rollback()
+                logging.exception(f"Write-behind flush attempt {attempt} failed")
+            finally:
+                db.close()
+        else:
+            self.dropped += len(events)
+            return
+        for callback in committed:
+            if callback is not None:
+                callback()
+        elapsed = time.monotonic() - start
+        self.flushes += 1
+        self.flushed += len(events)
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.total_flush_seconds += elapsed
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+            "total_flush_seconds": self.total_flush_seconds,
+        }
+
+
+buffer = WriteBehindBuffer(
+    max_events=settings.write_behind_max_events,
+    batch_size=settings.write_behind_batch_size,
+    flush_interval=settings.write_behind_flush_ms / 1000,
+    put_timeout=settings.write_behind_put_timeout,
+)
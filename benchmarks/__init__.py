@@ -0,0 +1,3 @@
+"""
+Offline benchmarks of the API against a stub Gophie, see benchmarks.run
+"""
@@ -0,0 +1,506 @@
+"""
+Benchmarks every API route against a seeded database and a stub Gophie
+
+    python -m benchmarks.run --output result.json --baseline baseline.json
+
+By default the app and the stub run in process on a fresh SQLite database
+that is migrated and seeded first. Pass --url to benchmark a running
+server instead, its DATABASE_URL must be given so scenarios can pick
+seeded movies and its INTERNAL_TOKEN set for the internal routes.
+Throughput and p50/p95/p99 latencies of each scenario are written as
+JSON, and compared with the baseline's when one is given
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+from typing import Callable, List, NamedTuple
+
+import httpx
+
+from benchmarks import stub_gophie
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# engines the stub serves, the stored engine is only in the database
+REMOTE_ENGINE = "netnaija"
+STORED_ENGINE = "archive"
+
+
+class Fixtures(NamedTuple):
+    """Seeded movies the scenarios pick their requests from"""
+
+    movies: List[tuple]
+    # (referral_id, ip_address) of stored ratings
+    ratings: List[tuple]
+    rng: random.Random
+
+    def movie(self):
+        return self.rng.choice(self.movies)
+
+    def rating(self):
+        return self.rng.choice(self.ratings)
+
+    def referral_id(self):
+        return self.movie()[0]
+
+    def ip_address(self):
+        return f"192.168.{self.rng.randrange(256)}.{self.rng.randrange(256)}"
+
+    def word(self):
+        return self.movie()[1].split()[self.rng.randrange(3)]
+
+
+class Scenario(NamedTuple):
+    name: str
+    # returns the method, url and httpx keyword arguments of a request
+    request: Callable[[Fixtures], tuple]
+
+
+def by_referral(url: str):
+    return lambda f: ("POST", url, {"json": {"referral_id": f.referral_id()}})
+
+
+def by_ip(url: str):
+    return lambda f: (
+        "POST",
+        url,
+        {"json": {"referral_id": f.referral_id(), "ip_address": f.ip_address()}},
+    )
+
+
+def listing(url: str, engine: str, **params):
+    return lambda f: (
+        "GET",
+        url,
+        {"params": {"engine": engine, "page": f.rng.randint(1, 50), **params}},
+    )
+
+
+def searching(engine: str):
+    return lambda f: (
+        "GET",
+        "/search/",
+        {"params": {"engine": engine, "query": f.word(), "page": 1}},
+    )
+
+
+SCENARIOS = [
+    Scenario("average_ratings", by_referral("/movie/ratings/average/")),
+    Scenario(
+        "ip_rating",
+        lambda f: (
+            "POST",
+            "/movie/rating/",
+            {"json": dict(zip(("referral_id", "ip_address"), f.rating()))},
+        ),
+    ),
+    Scenario("downloads", by_referral("/movie/downloads/")),
+    Scenario("referrals", by_referral("/movie/referrals/")),
+    Scenario(
+        "movies_stats",
+        lambda f: (
+            "POST",
+            "/movies/stats/",
+            {"json": {"referral_ids": [f.referral_id() for _ in range(20)]}},
+        ),
+    ),
+    Scenario("ratings", by_referral("/rating/")),
+    Scenario(
+        "referral_by_id",
+        lambda f: (
+            "POST",
+            "/referral/id/",
+            {"params": {"referral_id": f.referral_id()}},
+        ),
+    ),
+    Scenario(
+        "movie_by_schema",
+        lambda f: (
+            "POST",
+            "/movie/",
+            {"json": dict(zip(("name", "engine"), f.movie()[1:]))},
+        ),
+    ),
+    Scenario(
+        "highest_downloads",
+        lambda f: (
+            "POST",
+            "/download/highest/",
+            {
+                "json": {
+                    "filter_by": f.rng.choice(("hours", "days", "weeks")),
+                    "filter_num": f.rng.randint(1, 4),
+                    "top": 20,
+                }
+            },
+        ),
+    ),
+    Scenario("list_remote", listing("/list/", REMOTE_ENGINE)),
+    Scenario("list_stored", listing("/list/", STORED_ENGINE)),
+    Scenario("list_stored_full", listing("/list/", STORED_ENGINE, full=True)),
+    Scenario("search_remote", searching(REMOTE_ENGINE)),
+    Scenario("search_stored", searching(STORED_ENGINE)),
+    Scenario(
+        "export_downloads",
+        lambda f: (
+            "GET",
+            "/export/downloads/",
+            {
+                "params": {
+                    "since": (
+                        datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+                    ).isoformat()
+                }
+            },
+        ),
+    ),
+    Scenario("internal_stats", lambda f: ("GET", "/internal/stats/", {})),
+    Scenario("metrics", lambda f: ("GET", "/metrics", {})),
+    # writes last, so they do not change what the reads above see
+    Scenario(
+        "rate",
+        lambda f: (
+            "POST",
+            "/rate/",
+            {
+                "json": {
+                    "referral_id": f.referral_id(),
+                    "ip_address": f.ip_address(),
+                    "score": str(f.rng.randint(1, 5)),
+                }
+            },
+        ),
+    ),
+    Scenario("refer", by_ip("/referral/")),
+    Scenario("download", by_ip("/download/")),
+]
+
+
+def percentile(latencies: List[float], percent: float):
+    """Nearest-rank percentile of sorted latencies"""
+    return latencies[max(math.ceil(percent / 100 * len(latencies)) - 1, 0)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    fixtures: Fixtures,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+):
+    """Sends `requests` requests from `concurrency` concurrent workers"""
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(count: int, record: bool):
+        nonlocal errors
+        for _ in range(count):
+            method, url, kwargs = scenario.request(fixtures)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            elapsed = time.perf_counter() - start
+            if record:
+                latencies.append(elapsed)
+                errors += response.status_code >= 400
+
+    await worker(warmup, record=False)
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            worker(requests // concurrency + (i < requests % concurrency), True)
+            for i in range(concurrency)
+        )
+    )
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def compare(result: dict, baseline: dict, tolerance: float):
+    """
+    Rows of (scenario, metric, baseline, result, change) for the scenarios
+    of both runs, with whether the change is a regression beyond tolerance
+    """
+    rows = []
+    for name, current in result["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in (
+            ("throughput", True),
+            ("p50_ms", False),
+            ("p95_ms", False),
+            ("p99_ms", False),
+        ):
+            change = (current[metric] - previous[metric]) / max(previous[metric], 1e-9)
+            worse = -change if higher_is_better else change
+            rows.append(
+                (
+                    name,
+                    metric,
+                    previous[metric],
+                    current[metric],
+                    change,
+                    worse > tolerance,
+                )
+            )
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'scenario':<20}{'metric':<12}{'baseline':>12}{'result':>12}{'change':>10}")
+    for name, metric, previous, current, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(
+            f"{name:<20}{metric:<12}{previous:>12}{current:>12}{change:>+10.1%}{flag}"
+        )
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def migrate():
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(BASE_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BASE_DIR, "alembic"))
+    command.upgrade(config, "head")
+
+
+def load_fixtures(random_seed: int, limit: int = 10000):
+    from app.models import SessionLocal, models
+
+    db = SessionLocal()
+    try:
+        movies = (
+            db.query(models.Movie.referral_id, models.Movie.name, models.Movie.engine)
+            .order_by(models.Movie.id)
+            .limit(limit)
+            .all()
+        )
+        ratings = (
+            db.query(models.Movie.referral_id, models.Rating.ip_address)
+            .join(models.Rating.owner)
+            .order_by(models.Rating.id)
+            .limit(limit)
+            .all()
+        )
+    finally:
+        db.close()
+    if not (movies and ratings):
+        sys.exit("No movies or ratings in the database, seed it first")
+    return Fixtures(
+        [tuple(movie) for movie in movies],
+        [tuple(rating) for rating in ratings],
+        random.Random(random_seed),
+    )
+
+
+async def wait_until_ready(timeout: float = 300):
+    """Waits for the in-process indexes the app builds on startup"""
+    from app import fuzzy, trending
+    from app.settings import settings
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (not settings.fuzzy_index_enabled or fuzzy.index.ready) and (
+            not settings.trending_enabled or trending.downloads.ready
+        ):
+            return
+        await asyncio.sleep(0.1)
+
+
+def internal_headers():
+    """Headers of every request, internal routes need INTERNAL_TOKEN"""
+    token = os.environ.get("INTERNAL_TOKEN")
+    return {"X-Internal-Token": token} if token else {}
+
+
+async def benchmark(args, scenarios: List[Scenario]):
+    fixtures = load_fixtures(args.seed)
+    results = {}
+    if args.url:
+        client = httpx.AsyncClient(
+            base_url=args.url, headers=internal_headers(), timeout=args.timeout
+        )
+        app = None
+    else:
+        from main import app
+        from app import utils
+
+        stub = stub_gophie.create_app(
+            latency_ms=args.stub_latency_ms,
+            jitter_ms=args.stub_jitter_ms,
+            movies=args.stub_movies,
+            description_bytes=args.stub_description_bytes,
+            engines=(REMOTE_ENGINE,),
+        )
+        # started before the app, so startup keeps this client
+        utils._gophie_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=stub)
+        )
+        await app.router.startup()
+        await wait_until_ready()
+        client = httpx.AsyncClient(
+            # unhandled errors are counted as 500s like a server would send
+            transport=httpx.ASGITransport(app=app, raise_app_exceptions=False),
+            base_url="http://ocena",
+            headers=internal_headers(),
+            timeout=args.timeout,
+        )
+    try:
+        for scenario in scenarios:
+            results[scenario.name] = summary = await run_scenario(
+                client,
+                scenario,
+                fixtures,
+                args.requests,
+                args.concurrency,
+                args.warmup,
+            )
+            print(
+                f"{scenario.name:<20}{summary['throughput']:>10} req/s  "
+                f"p50 {summary['p50_ms']:>9} ms  p95 {summary['p95_ms']:>9} ms  "
+                f"p99 {summary['p99_ms']:>9} ms  errors {summary['errors']}",
+                file=sys.stderr,
+            )
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+    return results
+
+
+def parse_args(argv=None):
+    from benchmarks import seed
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="a previous --output to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="relative change counted as a regression, exits with 1 if any",
+    )
+    parser.add_argument("--scenarios", help="comma separated, defaults to all")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--url", help="benchmark a running server")
+    parser.add_argument(
+        "--database-url",
+        help="defaults to a new SQLite database, or DATABASE_URL with --url",
+    )
+    parser.add_argument(
+        "--no-seed", action="store_true", help="use the movies already stored"
+    )
+    parser.add_argument("--stub-latency-ms", type=float, default=50)
+    parser.add_argument("--stub-jitter-ms", type=float, default=10)
+    parser.add_argument("--stub-movies", type=int, default=20)
+    parser.add_argument("--stub-description-bytes", type=int, default=200)
+    seed.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def configure_database(argv=None):
+    """
+    Points the app at the benchmark database, before any app module is
+    imported as they read DATABASE_URL once
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--url")
+    parser.add_argument("--database-url")
+    args, _ = parser.parse_known_args(argv)
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    elif not args.url:
+        directory = tempfile.mkdtemp(prefix="ocena-benchmark-")
+        os.environ["DATABASE_URL"] = f"sqlite:///{directory}/benchmark.sqlite3"
+    if not args.url:
+        # lets the internal routes be benchmarked in process
+        os.environ.setdefault("INTERNAL_TOKEN", "benchmark")
+
+
+def main(argv=None):
+    configure_database(argv)
+    args = parse_args(argv)
+    scenarios = SCENARIOS
+    if args.scenarios:
+        wanted = args.scenarios.split(",")
+        scenarios = [scenario for scenario in SCENARIOS if scenario.name in wanted]
+    from app.models import SessionLocal
+    from benchmarks import seed
+
+    if not args.url:
+        migrate()
+    if not (args.url or args.no_seed):
+        db = SessionLocal()
+        try:
+            seed.seed_from_arguments(db, args)
+        finally:
+            db.close()
+
+    result = {
+        "meta": {
+            "started_at": datetime.datetime.utcnow().isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "database": os.environ.get("DATABASE_URL", "").split(":", 1)[0],
+            "target": args.url or "in-process",
+            "arguments": {
+                name: value
+                for name, value in vars(args).items()
+                if name not in ("output", "baseline", "database_url")
+            },
+        },
+        "scenarios": asyncio.run(benchmark(args, scenarios)),
+    }
+    with open(args.output, "w") as output:
+        json.dump(result, output, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            rows = compare(result, json.load(baseline_file), args.tolerance)
+        print_comparison(rows)
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Seeds the database with synthetic movies and events
+
+    python -m benchmarks.seed --movies 10000 --ratings 50000 --downloads 200000
+
+Runs against settings.database_url, whose tables must exist. Movies are
+spread over the engines and their last `days` days, events favour a few
+popular movies like real traffic does. The same seed gives the same data
+"""
+import sys
+import time
+import uuid
+import random
+import argparse
+import datetime
+import ipaddress
+from typing import Sequence
+
+from sqlalchemy.orm import Session
+
+from app import bulk_import
+from app.models import SessionLocal, models
+
+ENGINES = ("netnaija", "fzmovies", "archive")
+WORDS = (
+    "dark night rising star lost city river king queen last dawn storm "
+    "ghost house blue summer winter road home war love secret island"
+).split()
+BATCH_SIZE = 10000
+
+
+def ip_address(number: int):
+    return str(ipaddress.IPv4Address(0x0A000000 + number))
+
+
+def popular_movie(rng: random.Random, movie_ids: Sequence[int]):
+    """A movie id, the first movies are picked far more often"""
+    return movie_ids[min(int(rng.paretovariate(1.2)) - 1, len(movie_ids) - 1)]
+
+
+def seed_movies(db: Session, rng: random.Random, count: int, engines, days: int):
+    now = datetime.datetime.utcnow()
+    table = models.Movie.__table__
+    for start in range(0, count, BATCH_SIZE):
+        rows = []
+        for number in range(start, min(start + BATCH_SIZE, count)):
+            title = " ".join(rng.sample(WORDS, 3))
+            rows.append(
+                {
+                    "name": f"{title} {number}",
+                    "engine": engines[number % len(engines)],
+                    "referral_id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "date_created": now - datetime.timedelta(
+                        seconds=rng.uniform(0, days * 86400)
+                    ),
+                    "description": title,
+                    "year": str(rng.randint(1980, 2021)),
+                    "rating_sum": 0,
+                    "rating_count": 0,
+                }
+            )
+        db.execute(table.insert(), rows)
+    return [movie_id for movie_id, in db.query(models.Movie.id).order_by("id")]
+
+
+def seed_ratings(db: Session, rng: random.Random, count: int, movie_ids):
+    """Ratings by distinct ip addresses, with the movies' aggregates"""
+    sums, counts = {}, {}
+    for start in range(0, count, BATCH_SIZE):
+        rows = []
+        for number in range(start, min(start + BATCH_SIZE, count)):
+            movie_id = popular_movie(rng, movie_ids)
+            score = rng.randint(1, 5)
+            rows.append(
+                {"movie_id": movie_id, "ip_address": ip_address(number), "score": score}
+            )
+            sums[movie_id] = sums.get(movie_id, 0) + score
+            counts[movie_id] = counts.get(movie_id, 0) + 1
+        db.execute(models.Rating.__table__.insert(), rows)
+    db.bulk_update_mappings(
+        models.Movie,
+        [
+            {"id": movie_id, "rating_sum": sums[movie_id], "rating_count": count}
+            for movie_id, count in counts.items()
+        ],
+    )
+
+
+def seed_events(
+    db: Session, rng: random.Random, importer, count: int, movie_ids, days: int
+):
+    """Downloads or referrals through the bulk importers"""
+    now = datetime.datetime.utcnow()
+    for start in range(0, count, BATCH_SIZE):
+        importer(
+            db,
+            [
+                {
+                    "movie_id": popular_movie(rng, movie_ids),
+                    "ip_address": ip_address(rng.randrange(1 << 20)),
+                    "datetime": now
+                    - datetime.timedelta(seconds=rng.uniform(0, days * 86400)),
+                }
+                for _ in range(start, min(start + BATCH_SIZE, count))
+            ],
+        )
+
+
+def seed(
+    db: Session,
+    movies: int,
+    ratings: int = 0,
+    downloads: int = 0,
+    referrals: int = 0,
+    engines: Sequence[str] = ENGINES,
+    days: int = 30,
+    random_seed: int = 0,
+):
+    """Inserts the synthetic data and commits, returns the movie ids"""
+    rng = random.Random(random_seed)
+    movie_ids = seed_movies(db, rng, movies, engines, days)
+    # random order, so popular movies are spread over the engines
+    popular = rng.sample(movie_ids, len(movie_ids))
+    seed_ratings(db, rng, ratings, popular)
+    seed_events(db, rng, bulk_import.import_downloads, downloads, popular, days)
+    seed_events(db, rng, bulk_import.import_referrals, referrals, popular, days)
+    db.commit()
+    return movie_ids
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--movies", type=int, default=10000)
+    parser.add_argument("--ratings", type=int, default=50000)
+    parser.add_argument("--downloads", type=int, default=100000)
+    parser.add_argument("--referrals", type=int, default=50000)
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def seed_from_arguments(db: Session, args: argparse.Namespace):
+    start = time.monotonic()
+    seed(
+        db,
+        args.movies,
+        args.ratings,
+        args.downloads,
+        args.referrals,
+        args.engines.split(","),
+        args.days,
+        args.seed,
+    )
+    print(
+        f"Seeded {args.movies} movies, {args.ratings} ratings, {args.downloads} "
+        f"downloads and {args.referrals} referrals in "
+        f"{time.monotonic() - start:.1f}s",
+        file=sys.stderr,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    db = SessionLocal()
+    try:
+        seed_from_arguments(db, args)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Local stand-in for the Gophie API with configurable latency and payload size
+
+    STUB_LATENCY_MS=80 STUB_MOVIES=20 uvicorn benchmarks.stub_gophie:app --port 9000
+
+Listings and searches are generated from the engine, page and query so
+repeated requests return the same movies. Engines outside STUB_ENGINES
+answer 404 straight away, which sends ocena to its stored movies
+"""
+import os
+import random
+import asyncio
+from typing import Sequence
+
+from fastapi import FastAPI, Response
+
+ENGINES = ("netnaija", "fzmovies")
+
+
+def movie_payload(engine: str, title: str, description_bytes: int):
+    """A movie as Gophie returns it, in camel case"""
+    return {
+        "index": 0,
+        "title": title,
+        "source": engine,
+        "description": "x" * description_bytes,
+        "size": "700MB",
+        "year": "2020",
+        "downloadLink": f"https://stub.gophie/{engine}/{title.replace(' ', '-')}",
+        "coverPhotoLink": "https://stub.gophie/cover.jpg",
+        "quality": "720p",
+        "isSeries": False,
+        "sDownloadLink": None,
+        "category": "Movie",
+        "cast": "",
+        "uploadDate": "2020-01-01",
+        "subtitleLink": "",
+        "subtitleLinks": None,
+        "imdbLink": "",
+        "tags": "",
+    }
+
+
+def create_app(
+    latency_ms: float = 50,
+    jitter_ms: float = 0,
+    movies: int = 20,
+    description_bytes: int = 200,
+    engines: Sequence[str] = ENGINES,
+    seed: int = 0,
+):
+    stub = FastAPI()
+    rng = random.Random(seed)
+    served = {engine.lower() for engine in engines}
+
+    async def respond(engine: str, titles):
+        if engine.lower() not in served:
+            return Response(status_code=404)
+        delay = latency_ms + rng.uniform(-jitter_ms, jitter_ms)
+        await asyncio.sleep(max(delay, 0) / 1000)
+        return [movie_payload(engine, title, description_bytes) for title in titles]
+
+    @stub.get("/list")
+    async def list_movies(engine: str, page: int = 1, num: int = movies):
+        titles = [f"{engine} movie {page}-{i}" for i in range(num)]
+        return await respond(engine, titles)
+
+    @stub.get("/search")
+    async def search_movies(engine: str, query: str, page: int = 1):
+        titles = [f"{query} {engine} {page}-{i}" for i in range(movies)]
+        return await respond(engine, titles)
+
+    return stub
+
+
+app = create_app(
+    latency_ms=float(os.environ.get("STUB_LATENCY_MS", 50)),
+    jitter_ms=float(os.environ.get("STUB_JITTER_MS", 0)),
+    movies=int(os.environ.get("STUB_MOVIES", 20)),
+    description_bytes=int(os.environ.get("STUB_DESCRIPTION_BYTES", 200)),
+    engines=os.environ.get("STUB_ENGINES", ",".join(ENGINES)).split(","),
+)
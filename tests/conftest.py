@@ -0,0 +1,63 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from main import app
+from app import cache, circuit, latency, utils
+from app.models import models, get_db
+from app.settings import settings
+
+
+@pytest.fixture
+def db():
+    """In-memory database with all tables created"""
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    models.Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    """Test client whose requests and Gophie pages use the in-memory database"""
+    cache.clear_all()
+    circuit.reset()
+    latency.reset()
+    monkeypatch.setattr(utils, "SessionLocal", sessionmaker(bind=db.get_bind()))
+    app.dependency_overrides[get_db] = lambda: db
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def internal_headers(monkeypatch):
+    """Headers of requests to internal routes"""
+    monkeypatch.setattr(settings, "internal_token", "test-token")
+    return {"X-Internal-Token": "test-token"}
+
+
+@pytest.fixture
+def statements(db):
+    """Records every SQL statement sent through the in-memory database"""
+    recorded = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        recorded.append(statement)
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield recorded
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
@@ -1,6 +1,15 @@
+import asyncio
+import datetime
+
+import httpx
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
 from main import app
+from app import cache, utils
+from benchmarks import stub_gophie
+from app.models import crud, models
+from app.settings import settings
 
 client = TestClient(app)
 
@@ -13,3 +22,160 @@ def test_read_main():
 def test_read_docs():
     response = client.get("/docs")
     assert response.status_code == 200
+
+
+def test_highest_downloads_query_count_does_not_grow_with_top(client, db, statements):
+    movies = crud.upsert_movies(
+        db, [models.Movie(name=str(i), engine="netnaija") for i in range(5)]
+    )
+    for movie in movies:
+        client.post(
+            "/download/", json={"ip_address": "1", "referral_id": movie.referral_id}
+        )
+
+    counts = []
+    for top in (1, 5):
+        cache.clear_all()
+        del statements[:]
+        response = client.post(
+            "/download/highest/",
+            json={"filter_by": "days", "filter_num": 1, "top": top},
+        )
+        assert len(response.json()) == top
+        counts.append(len(statements))
+    assert counts[0] == counts[1] == 1
+
+
+def test_movies_stats_returns_every_requested_movie(client, db, statements):
+    a, b = [
+        movie.referral_id
+        for movie in crud.upsert_movies(
+            db, [models.Movie(name=name, engine="netnaija") for name in "ab"]
+        )
+    ]
+    for ip_address, score in (("1", "3"), ("2", "4")):
+        client.post(
+            "/rate/",
+            json={"ip_address": ip_address, "referral_id": a, "score": score},
+        )
+    client.post("/download/", json={"ip_address": "1", "referral_id": b})
+    client.post("/referral/", json={"ip_address": "1", "referral_id": b})
+
+    del statements[:]
+    response = client.post("/movies/stats/", json={"referral_ids": [b, a, "missing"]})
+    assert [
+        (movie["average_ratings"], movie["by"], movie["downloads"], movie["referrals"])
+        for movie in response.json()
+    ] == [(0, 0, 1, 1), (3.5, 2, 0, 0), (0, 0, 0, 0)]
+    # the missing referral id and the counts of the others
+    assert len(statements) == 2
+
+
+def test_list_cursor_pages_through_stored_movies(client, db, monkeypatch):
+    monkeypatch.setattr(
+        utils,
+        "_gophie_client",
+        httpx.AsyncClient(transport=httpx.MockTransport(lambda _: httpx.Response(500))),
+    )
+    crud.upsert_movies(
+        db,
+        [
+            models.Movie(
+                name=str(i),
+                engine="netnaija",
+                date_created=datetime.datetime(2020, 1, 1 + i),
+            )
+            for i in range(3)
+        ],
+    )
+
+    response = client.get("/list/", params={"num": 2})
+    names = [movie["name"] for movie in response.json()]
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/list/", params={"num": 2, "cursor": cursor})
+    names += [movie["name"] for movie in response.json()]
+    assert names == ["2", "1", "0"]
+    assert "X-Next-Cursor" not in response.headers
+    assert client.get("/list/", params={"cursor": "nope"}).status_code == 400
+
+
+def test_empty_pages_fall_back_to_an_empty_list(client, monkeypatch):
+    monkeypatch.setattr(
+        utils,
+        "_gophie_client",
+        httpx.AsyncClient(transport=httpx.MockTransport(lambda _: httpx.Response(500))),
+    )
+    for path in ("/list/", "/search/"):
+        response = client.get(path, params={"num": 0})
+        assert (response.status_code, response.json()) == (200, [])
+
+
+def test_internal_stats_require_the_internal_token(client, monkeypatch):
+    # refused by every worker that has no token configured
+    monkeypatch.setattr(settings, "internal_token", "")
+    assert client.get("/internal/stats/").status_code == 403
+
+    monkeypatch.setattr(settings, "internal_token", "secret")
+    assert client.get("/internal/stats/").status_code == 401
+    headers = {"X-Internal-Token": "wrong"}
+    assert client.get("/internal/stats/", headers=headers).status_code == 401
+    headers = {"X-Internal-Token": "secret"}
+    assert client.get("/internal/stats/", headers=headers).status_code == 200
+
+
+def test_gophie_pages_are_cached_without_their_counts(client, monkeypatch):
+    calls = []
+
+    def gophie(request):
+        calls.append(request)
+        return httpx.Response(200, json=[stub_gophie.movie_payload("netnaija", "a", 0)])
+
+    transport = httpx.MockTransport(gophie)
+    monkeypatch.setattr(utils, "_gophie_client", httpx.AsyncClient(transport=transport))
+    stale_hits = utils.get_movies_from_remote.cache.stats()["stale_hits"]
+    (movie,) = client.get("/list/").json()
+    assert movie["downloads"] == 0
+
+    client.post(
+        "/download/", json={"ip_address": "1", "referral_id": movie["referral_id"]}
+    )
+    (movie,) = client.get("/list/").json()
+    assert movie["downloads"] == 1
+    (movie,) = client.get("/list/", params={"full": True}).json()
+    assert len(movie["downloads"]) == 1
+    # the download neither refetched nor staled the cached page
+    assert len(calls) == 1
+    assert utils.get_movies_from_remote.cache.stats()["stale_hits"] == stale_hits
+
+
+def test_coalesced_gophie_pages_are_saved_with_their_own_session(
+    client, db, monkeypatch
+):
+    sessions = []
+
+    def session():
+        sessions.append(sessionmaker(bind=db.get_bind())())
+        return sessions[-1]
+
+    async def gophie(request):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json=[stub_gophie.movie_payload("netnaija", "a", 0)])
+
+    transport = httpx.MockTransport(gophie)
+    monkeypatch.setattr(utils, "_gophie_client", httpx.AsyncClient(transport=transport))
+    monkeypatch.setattr(utils, "SessionLocal", session)
+
+    async def list_twice():
+        params = {"engine": "netnaija", "page": 1}
+        return await asyncio.gather(
+            *(
+                utils.get_movies_from_remote("http://gophie/list", params, "netnaija")
+                for _ in range(2)
+            )
+        )
+
+    first, second = asyncio.run(list_twice())
+    assert first == second and [movie.name for movie in first] == ["a"]
+    # one call for both requests, which saved with a session it closed
+    assert len(sessions) == 1
+    assert not sessions[0].in_transaction()
@@ -0,0 +1,57 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy.pool import StaticPool
+
+from app.models import async_crud, async_database_url, models, schemas
+
+pytest.importorskip("aiosqlite")
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+
+def test_async_database_url_uses_async_drivers():
+    assert (
+        str(async_database_url("postgresql://user:pass@db/ocena"))
+        == "postgresql+asyncpg://user:pass@db/ocena"
+    )
+    assert (
+        str(async_database_url("sqlite:///db.sqlite3"))
+        == "sqlite+aiosqlite:///db.sqlite3"
+    )
+
+
+def test_crud_runs_on_an_async_session():
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with engine.begin() as connection:
+            await connection.run_sync(models.Base.metadata.create_all)
+        async with AsyncSession(engine) as db:
+            movies = await async_crud.upsert_movies(
+                db,
+                [
+                    models.Movie(
+                        name="Hello",
+                        engine="netnaija",
+                        date_created=datetime.datetime(2020, 1, 1),
+                    )
+                ],
+            )
+            referral_id = movies[0].referral_id
+            await async_crud.create_or_update_rating(
+                db=db,
+                spec_rating=schemas.SpecificRatingScore(
+                    ip_address="1", referral_id=referral_id, score="4"
+                ),
+            )
+            page = await async_crud.list_movies(db, "netnaija", 1, 20)
+            movie = await async_crud.get_movie_by_schema(
+                db, schemas.MovieBase(name="Hello", engine="netnaija")
+            )
+        await engine.dispose()
+        return page, movie
+
+    page, movie = asyncio.run(scenario())
+    assert [movie.name for movie in page.movies] == ["Hello"]
+    assert page.movies[0].average_ratings.average_ratings == 4
+    assert [rating.score for rating in movie.ratings] == [4]
@@ -0,0 +1,39 @@
+from benchmarks import run, stub_gophie
+from app import utils
+from app.models import models
+
+
+def test_percentiles_use_the_nearest_rank():
+    latencies = [i / 1000 for i in range(1, 101)]
+    summary = run.summarize(latencies, errors=1, elapsed=2)
+    assert (summary["p50_ms"], summary["p95_ms"], summary["p99_ms"]) == (50, 95, 99)
+    assert summary["throughput"] == 50
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    def result(throughput, p95):
+        return {
+            "scenarios": {
+                "list": {
+                    "throughput": throughput,
+                    "p50_ms": 10,
+                    "p95_ms": p95,
+                    "p99_ms": 30,
+                }
+            }
+        }
+
+    rows = run.compare(result(90, 25), result(100, 20), tolerance=0.1)
+    regressed = {metric for _, metric, *_, flagged in rows if flagged}
+    assert regressed == {"p95_ms"}
+
+
+def test_stub_movies_are_saved_by_ocena(db):
+    stub = stub_gophie.create_app(latency_ms=0)
+    payload = stub_gophie.movie_payload("netnaija", "a movie", 10)
+
+    movies = utils.save_movies(db, {"engine": "netnaija"}, [payload])
+
+    assert [movie.name for movie in movies] == ["a movie"]
+    assert db.query(models.Movie).count() == 1
+    assert {route.path for route in stub.routes} >= {"/list", "/search"}
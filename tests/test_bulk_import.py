@@ -0,0 +1,41 @@
+import json
+import datetime
+
+from app import bulk_import, cache
+from app.models import crud, models, schemas
+
+
+def test_bulk_import_loads_events_and_aggregates(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_import, "SessionLocal", lambda: db)
+    cache.clear_all()
+    movie = crud.upsert_movies(db, [models.Movie(name="a", engine="netnaija")])[0]
+    referral_id = movie.referral_id
+    crud.create_or_update_rating(
+        db,
+        schemas.SpecificRatingScore(ip_address="1", referral_id=referral_id, score="2"),
+    )
+
+    downloads = tmp_path / "downloads.csv"
+    downloads.write_text(
+        "referral_id,ip_address,datetime\n"
+        f"{referral_id},1,2020-01-01T10:15:00\n"
+        f"{referral_id},2,2020-01-01T10:45:00Z\n"
+        "unknown,3,2020-01-01T10:45:00\n"
+    )
+    ratings = tmp_path / "ratings.ndjson"
+    ratings.write_text(
+        "\n".join(
+            json.dumps({"referral_id": referral_id, "ip_address": ip, "score": score})
+            for ip, score in (("1", 5), ("2", 3), ("2", 4))
+        )
+    )
+    bulk_import.main(["downloads", str(downloads), "--batch-size", "2"])
+    bulk_import.main(["ratings", str(ratings)])
+
+    assert db.query(models.Download).count() == 2
+    bucket = db.query(models.DownloadBucket).one()
+    assert (bucket.bucket_start, bucket.count) == (datetime.datetime(2020, 1, 1, 10), 2)
+    # ip 1 changed its score from 2 to 5 and ip 2 rated 4
+    movie = db.query(models.Movie).one()
+    assert (movie.rating_sum, movie.rating_count) == (9, 2)
+    assert sorted(rating.score for rating in movie.ratings) == [4, 5]
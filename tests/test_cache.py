@@ -0,0 +1,142 @@
+import asyncio
+
+from app import cache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    ttl_cache = cache.TTLCache("test", ttl=60, maxsize=2)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    assert ttl_cache.get("a") == 1
+    ttl_cache.set("c", 3)
+    assert ttl_cache.get("b", None) is None
+    assert ttl_cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_expires_entries():
+    ttl_cache = cache.TTLCache("test", ttl=0, maxsize=2)
+    ttl_cache.set("a", 1)
+    assert ttl_cache.get("a", None) is None
+    assert ttl_cache.stats()["expirations"] == 1
+
+
+def test_cached_keys_on_arguments_and_fires_hooks():
+    calls = []
+
+    @cache.cached("test_cached", key=lambda db, engine: engine)
+    def listing(db, engine):
+        calls.append(engine)
+        return [engine]
+
+    @cache.on("test_event")
+    def invalidate(engine):
+        listing.cache.invalidate(engine)
+
+    assert listing(object(), "netnaija") == ["netnaija"]
+    assert listing(object(), "netnaija") == ["netnaija"]
+    assert calls == ["netnaija"]
+    cache.fire("test_event", engine="netnaija")
+    listing(object(), "netnaija")
+    assert calls == ["netnaija", "netnaija"]
+    assert cache.stats()["test_cached"]["hits"] == 1
+
+
+def test_cached_does_not_keep_none_results():
+    movies = {}
+
+    @cache.cached("test_cached_none", key=lambda referral_id: referral_id)
+    def movie(referral_id):
+        return movies.get(referral_id)
+
+    assert movie("a") is None
+    # created later, by another worker
+    movies["a"] = "movie"
+    assert movie("a") == "movie"
+
+
+def test_cached_coroutine_caches_awaited_result():
+    calls = []
+
+    @cache.cached("test_cached_async", key=lambda engine: engine)
+    async def fetch(engine):
+        calls.append(engine)
+        return engine
+
+    async def main():
+        return [await fetch("fzmovies"), await fetch("fzmovies")]
+
+    assert asyncio.run(main()) == ["fzmovies", "fzmovies"]
+    assert calls == ["fzmovies"]
+
+
+def test_stale_while_revalidate_keeps_serving_stale_results_until_refreshed():
+    results = iter(["fetched", RuntimeError("gophie is down"), "refreshed"])
+    # the first result is fresh for 10ms, the refreshed one stays fresh
+    soft_ttls = [0.01, 60]
+
+    @cache.stale_while_revalidate(
+        "test_swr",
+        key=lambda engine: engine,
+        ttls=lambda engine: (soft_ttls.pop(0), 600),
+        retry_after=0,
+    )
+    async def fetch(engine):
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def main():
+        served = [await fetch("netnaija")]
+        await asyncio.sleep(0.02)
+        served.append(await fetch("netnaija"))
+        # lets the background refresh run, it fails and is retried right away
+        await asyncio.sleep(0)
+        served.append(await fetch("netnaija"))
+        await asyncio.sleep(0)
+        served.append(await fetch("netnaija"))
+        served.append(await fetch("netnaija"))
+        return served
+
+    assert asyncio.run(main()) == [
+        "fetched",
+        "fetched",
+        "fetched",
+        "refreshed",
+        "refreshed",
+    ]
+    stats = fetch.cache.stats()
+    assert (stats["stale_hits"], stats["refreshes"], stats["refresh_failures"]) == (
+        2,
+        1,
+        1,
+    )
+
+
+def test_concurrent_misses_share_one_call():
+    calls = []
+
+    @cache.stale_while_revalidate(
+        "test_single_flight",
+        key=lambda engine, page: (engine, page),
+        ttls=lambda engine, page: (60, 600),
+        retry_after=0,
+    )
+    async def fetch(engine, page):
+        calls.append((engine, page))
+        await asyncio.sleep(0.01)
+        if page == 2:
+            raise RuntimeError("gophie is down")
+        return [engine, page]
+
+    async def main():
+        return await asyncio.gather(
+            *(fetch("netnaija", page) for page in (1, 1, 1, 2, 2)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(main())
+    assert results[:3] == [["netnaija", 1]] * 3
+    assert [str(error) for error in results[3:]] == ["gophie is down"] * 2
+    assert calls == [("netnaija", 1), ("netnaija", 2)]
+    assert fetch.cache.stats()["coalesced"] == 3
@@ -0,0 +1,67 @@
+import httpx
+
+from app import circuit, utils
+from app.models import crud, models
+from app.settings import settings
+
+
+def test_breaker_opens_on_failures_and_slow_calls_then_probes():
+    breaker = circuit.CircuitBreaker(
+        "test", failure_threshold=2, slow_seconds=1, open_seconds=0, probes=1
+    )
+    breaker.record(breaker.allow(), False, 0.1)
+    assert breaker.state == circuit.CLOSED
+    breaker.record(breaker.allow(), True, 2)
+    assert breaker.state == circuit.OPEN
+
+    # half open, a single probe at a time
+    probe = breaker.allow()
+    assert probe is not None and breaker.allow() is None
+    breaker.record(probe, False, 0.1)
+    assert breaker.state == circuit.OPEN
+    breaker.record(breaker.allow(), True, 0.1)
+    assert (breaker.state, breaker.opened, breaker.rejected) == (circuit.CLOSED, 2, 1)
+
+
+def test_breaker_ignores_calls_allowed_before_it_opened():
+    breaker = circuit.CircuitBreaker(
+        "test", failure_threshold=1, slow_seconds=1, open_seconds=0, probes=1
+    )
+    late = breaker.allow()
+    breaker.record(breaker.allow(), False, 0.1)
+    probe = breaker.allow()
+    assert breaker.state == circuit.HALF_OPEN
+
+    # neither closes the circuit nor takes the probe's place
+    breaker.record(late, True, 0.1)
+    assert breaker.state == circuit.HALF_OPEN
+    assert breaker.allow() is None
+    breaker.record(probe, True, 0.1)
+    assert breaker.state == circuit.CLOSED
+
+
+def test_open_circuit_serves_stored_movies_without_calling_gophie(
+    client, db, monkeypatch, internal_headers
+):
+    monkeypatch.setattr(settings, "gophie_breaker_failures", 2)
+    calls = []
+
+    def unavailable(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    monkeypatch.setattr(
+        utils,
+        "_gophie_client",
+        httpx.AsyncClient(transport=httpx.MockTransport(unavailable)),
+    )
+    crud.upsert_movies(db, [models.Movie(name="stored", engine="netnaija")])
+
+    for page in range(1, 5):
+        response = client.get("/list/", params={"engine": "netnaija", "page": page})
+        assert response.status_code == 200
+
+    assert len(calls) == 2
+    response = client.get("/internal/stats/", headers=internal_headers)
+    stats = response.json()["gophie_circuits"]["netnaija"]
+    assert (stats["state"], stats["rejected"]) == ("open", 2)
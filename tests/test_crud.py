@@ -0,0 +1,220 @@
+import datetime
+
+from app import cache, resolver
+from app.models import crud, models, schemas
+
+
+def make_movie(name, engine="netnaija", **kwargs):
+    return models.Movie(name=name, engine=engine, **kwargs)
+
+
+def test_upsert_movies_returns_rows_in_upstream_order(db):
+    movies = crud.upsert_movies(
+        db, [make_movie("b"), make_movie("a"), make_movie("c")]
+    )
+    assert [movie.name for movie in movies] == ["b", "a", "c"]
+    assert all(movie.id and movie.referral_id for movie in movies)
+
+
+def test_upsert_movies_keeps_old_values_when_new_are_empty(db):
+    (first,) = crud.upsert_movies(
+        db,
+        [
+            make_movie(
+                "a",
+                description="old",
+                size="1GB",
+                s_download_link={"1": "http://x"},
+                cover_photo_link="http://old",
+            )
+        ],
+    )
+    referral_id = first.referral_id
+    (second,) = crud.upsert_movies(
+        db,
+        [
+            make_movie(
+                "a",
+                description="",
+                size="2GB",
+                s_download_link={},
+                cover_photo_link="http://new",
+            )
+        ],
+    )
+    assert second.id == first.id
+    assert second.referral_id == referral_id
+    assert second.description == "old"
+    assert second.size == "2GB"
+    assert second.s_download_link == {"1": "http://x"}
+    assert second.cover_photo_link == "http://new"
+    assert db.query(models.Movie).count() == 1
+
+
+def test_upsert_movies_merges_duplicates_in_a_page(db):
+    movies = crud.upsert_movies(
+        db, [make_movie("a", size="1GB"), make_movie("a", tags="x")]
+    )
+    assert movies[0] is movies[1]
+    assert (movies[0].size, movies[0].tags) == ("1GB", "x")
+
+
+def test_rating_aggregates_follow_new_and_changed_scores(db):
+    (movie,) = crud.upsert_movies(db, [make_movie("a")])
+    for ip_address, score in (("1", "4"), ("2", "2"), ("1", "5")):
+        crud.create_or_update_rating(
+            db,
+            schemas.SpecificRatingScore(
+                ip_address=ip_address, referral_id=movie.referral_id, score=score
+            ),
+        )
+    db.refresh(movie)
+    assert (movie.rating_sum, movie.rating_count) == (7, 2)
+    average = crud.get_movie_average_ratings(
+        db, schemas.MovieRating(referral_id=movie.referral_id)
+    )
+    assert average == schemas.AverageRating(average_ratings=3.5, by=2)
+
+
+def download(db, movie, times=1):
+    for _ in range(times):
+        crud.create_download(
+            db,
+            schemas.DownloadCreate(ip_address="1", referral_id=movie.referral_id),
+        )
+
+
+def test_highest_downloads_ranks_movies_from_buckets(db):
+    cache.clear_all()
+    a, b, c = crud.upsert_movies(db, [make_movie(name) for name in "abc"])
+    download(db, a, 1)
+    download(db, b, 3)
+    download(db, c, 2)
+    assert db.query(models.DownloadBucket).count() == 3
+    highest = crud.get_highest_downloads(
+        db, schemas.DownloadFilter(filter_by="hours", filter_num=1, top=2)
+    )
+    assert [(movie.name, movie.downloads) for movie in highest] == [
+        ("b", 3),
+        ("c", 2),
+    ]
+
+
+def test_list_movies_pages_after_keyset_like_offsets(db):
+    created = datetime.datetime(2020, 1, 1)
+    crud.upsert_movies(
+        db,
+        [
+            models.Movie(
+                name=str(i),
+                engine="netnaija",
+                # pairs of movies share a date, ties are broken by id
+                date_created=created + datetime.timedelta(days=i // 2),
+            )
+            for i in range(5)
+        ]
+        + [models.Movie(name="searched", engine="netnaija")],
+    )
+
+    page = crud.list_movies(db, "NetNaija", 1, 2)
+    names = [movie.name for movie in page.movies]
+    while page.after:
+        page = crud.list_movies(db, "netnaija", 1, 2, after=page.after)
+        names += [movie.name for movie in page.movies]
+    offset_names = [
+        movie.name
+        for number in (1, 2, 3)
+        for movie in crud.list_movies(db, "netnaija", number, 2).movies
+    ]
+    assert names == offset_names == ["4", "3", "2", "1", "0"]
+
+
+def test_empty_pages_have_no_next_keyset(db):
+    crud.upsert_movies(
+        db, [make_movie("hello", date_created=datetime.datetime(2020, 1, 1))]
+    )
+    assert crud.list_movies(db, "netnaija", 1, 0) == schemas.MoviePage(movies=[])
+    page = crud.search_movies(db, "netnaija", "hello", 1, 0)
+    assert page == schemas.MoviePage(movies=[])
+
+
+def test_referral_ids_resolve_without_loading_movies(db, statements):
+    referral_id = crud.upsert_movies(db, [make_movie("a")])[0].referral_id
+    cache.clear_all()
+    resolver.load(db)
+
+    del statements[:]
+    crud.create_download(
+        db, schemas.DownloadCreate(ip_address="1", referral_id=referral_id)
+    )
+    crud.create_referral(
+        db, schemas.ReferralCreate(ip_address="1", referral_id=referral_id)
+    )
+    assert not [statement for statement in statements if "FROM movies" in statement]
+    movie = schemas.MovieRating(referral_id=referral_id)
+    assert crud.get_number_of_downloads(db, movie) == 1
+    assert crud.get_no_of_referrals(db, movie) == 1
+
+    missing = schemas.MovieRating(referral_id="missing")
+    assert crud.get_no_of_referrals(db, missing) == 0
+    del statements[:]
+    assert crud.get_number_of_downloads(db, missing) == 0
+    assert statements == []
+    # movies created later replace the cached miss
+    created = crud.create_movie(db, make_movie("b", referral_id="missing"))
+    assert resolver.resolve(db, "missing") == (created.id, "netnaija")
+
+
+def test_list_pages_load_counts_in_constant_queries(db, statements):
+    movies = crud.upsert_movies(
+        db,
+        [
+            make_movie(str(i), date_created=datetime.datetime(2020, 1, 1))
+            for i in range(20)
+        ],
+    )
+    for movie in movies[:2]:
+        referral_id = movie.referral_id
+        crud.create_download(
+            db, schemas.DownloadCreate(ip_address="1", referral_id=referral_id)
+        )
+        crud.create_referral(
+            db, schemas.ReferralCreate(ip_address="1", referral_id=referral_id)
+        )
+
+    cache.clear_all()
+    del statements[:]
+    page = crud.list_movies(db, "netnaija", 1, 20)
+    # the page and its counts
+    assert len(statements) == 2
+    assert sorted(movie.downloads for movie in page.movies)[-3:] == [0, 1, 1]
+    assert sum(movie.referrals for movie in page.movies) == 2
+
+    del statements[:]
+    page = crud.list_movies(db, "netnaija", 1, 20, full=True)
+    # the cached page's movies and one query per relationship
+    assert len(statements) == 4
+    assert sum(len(movie.downloads) for movie in page.movies) == 2
+
+
+def test_cached_pages_read_current_counts(db):
+    cache.clear_all()
+    created = datetime.datetime(2020, 1, 1)
+    movie = crud.upsert_movies(db, [make_movie("a", date_created=created)])[0]
+    page = crud.list_movies(db, "netnaija", 1, 20)
+    assert page.movies[0].downloads == 0
+
+    crud.create_download(
+        db, schemas.DownloadCreate(ip_address="1", referral_id=movie.referral_id)
+    )
+    crud.create_or_update_rating(
+        db,
+        schemas.SpecificRatingScore(
+            ip_address="1", referral_id=movie.referral_id, score="4"
+        ),
+    )
+    hits = crud.list_movie_page.cache.stats()["hits"]
+    page = crud.list_movies(db, "netnaija", 1, 20)
+    assert crud.list_movie_page.cache.stats()["hits"] == hits + 1
+    assert page.movies[0].downloads == 1
+    assert page.movies[0].average_ratings.by == 1
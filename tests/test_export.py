@@ -0,0 +1,84 @@
+import csv
+import json
+import datetime
+
+from app import export
+from app.models import crud, models, schemas
+
+
+def add_events(db):
+    movies = crud.upsert_movies(
+        db,
+        [
+            models.Movie(name="a", engine="netnaija"),
+            models.Movie(name="b", engine="fzmovies"),
+        ],
+    )
+    for movie, moment in zip(movies, ("2020-01-01", "2020-02-01")):
+        db.add(
+            models.Download(
+                movie_id=movie.id,
+                ip_address="1",
+                datetime=datetime.datetime.fromisoformat(moment),
+            )
+        )
+    db.commit()
+    crud.create_or_update_rating(
+        db,
+        schemas.SpecificRatingScore(
+            ip_address="1", referral_id=movies[0].referral_id, score="4"
+        ),
+    )
+    return movies
+
+
+def test_export_streams_filtered_ndjson(client, db, internal_headers):
+    movies = add_events(db)
+    response = client.get(
+        "/export/downloads/",
+        params={"engine": "NetNaija", "until": "2020-01-15T00:00:00"},
+        headers=internal_headers,
+    )
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {
+            "id": 1,
+            "movie_id": movies[0].id,
+            "referral_id": movies[0].referral_id,
+            "engine": "netnaija",
+            "ip_address": "1",
+            "datetime": "2020-01-01T00:00:00",
+        }
+    ]
+    response = client.get(
+        "/export/ratings/",
+        params={"since": "2020-01-01T00:00:00"},
+        headers=internal_headers,
+    )
+    assert response.status_code == 400
+    assert client.get("/export/movies/", headers=internal_headers).status_code == 404
+
+
+def test_export_requires_the_internal_token(client, db, internal_headers):
+    add_events(db)
+    assert client.get("/export/downloads/").status_code == 401
+    headers = {"X-Internal-Token": "wrong"}
+    assert client.get("/export/downloads/", headers=headers).status_code == 401
+    assert "/export/{kind}/" not in client.get("/openapi.json").json()["paths"]
+
+
+def test_export_cli_writes_csv_in_batches(db, tmp_path, monkeypatch):
+    add_events(db)
+    monkeypatch.setattr(export, "SessionLocal", lambda: db)
+    monkeypatch.setattr(export.settings, "export_batch_size", 1)
+    chunks = list(export.stream(export.query_events(db, "downloads"), "csv"))
+    assert len(chunks) == 2
+
+    output = tmp_path / "downloads.csv"
+    export.main(["downloads", "--format", "csv", "--output", str(output)])
+    with open(output, newline="") as exported:
+        rows = list(csv.DictReader(exported))
+    assert [(row["engine"], row["datetime"]) for row in rows] == [
+        ("netnaija", "2020-01-01T00:00:00"),
+        ("fzmovies", "2020-02-01T00:00:00"),
+    ]
@@ -0,0 +1,72 @@
+from app import fuzzy, search
+from app.models import crud, models
+
+
+def test_trigram_index_ranks_partial_matches_first():
+    index = fuzzy.TrigramIndex()
+    index.add(1, "The Hello Kitty Movie")
+    index.add(2, "Hello")
+    index.add(3, "Goodbye")
+    ranking = index.search("hello", limit=10)
+    assert [movie_id for _, movie_id in ranking] == [2, 1]
+    # every trigram of the query is shared and the names are identical
+    assert ranking[0][0] == len(fuzzy.trigrams("hello")) + 1
+    assert index.search("hello", limit=1, offset=1) == [ranking[1]]
+    assert index.search("hello", limit=10, after=ranking[0]) == [ranking[1]]
+
+
+def test_trigram_index_tombstones_renamed_movies():
+    index = fuzzy.TrigramIndex()
+    index.add(1, "Hello")
+    index.add(2, "Other")
+    index.add(1, "Goodbye")
+    index.add(1, "Goodbye")
+    assert index.search("hello", limit=10) == []
+    assert [movie_id for _, movie_id in index.search("goodbye", limit=10)] == [1]
+    assert len(index) == 3
+
+
+def test_ngram_search_uses_loaded_index(db, monkeypatch):
+    crud.upsert_movies(
+        db,
+        [
+            models.Movie(name=name, engine="NetNaija")
+            for name in ("Helo Kitty", "Goodbye")
+        ],
+    )
+    index = fuzzy.FuzzyIndex()
+    index.load(db)
+    monkeypatch.setattr(fuzzy, "index", index)
+    # added through the movies_saved hook
+    crud.upsert_movies(db, [models.Movie(name="Hello", engine="NetNaija")])
+
+    movies = search.backends["ngram"].search(db, "netnaija", "hello", 1, 20)
+    assert [movie.name for _, movie in movies] == ["Hello", "Helo Kitty"]
+
+
+def test_fuzzy_index_keeps_movies_saved_while_loading(db):
+    index = fuzzy.FuzzyIndex()
+    saved = models.Movie(id=1000, name="Hello", engine="netnaija")
+    # saved by the hook while the table is being read
+    index._pending = []
+    index.add_saved([saved])
+    assert not index.ready and index.engines == {}
+    index.load(db)
+    ranking = index.search("netnaija", "hello", 10)
+    assert [movie_id for _, movie_id in ranking] == [1000]
+
+
+def test_fuzzy_index_loads_movies_created_since_last_load(db):
+    crud.upsert_movies(db, [models.Movie(name="Hello", engine="netnaija")])
+    index = fuzzy.FuzzyIndex()
+    index.load(db)
+    # written by another worker, so no hook adds it here
+    db.execute(
+        models.Movie.__table__.insert().values(
+            name="Hello Again", engine="netnaija", referral_id="other"
+        )
+    )
+    db.commit()
+    index.load(db)
+    assert len(index.search("netnaija", "hello", 10)) == 2
+    assert index.max_id == db.query(models.Movie.id).count()
@@ -0,0 +1,92 @@
+import re
+import datetime
+
+from sqlalchemy import event
+
+from app import cache
+from app.models import crud, models, schemas
+
+TABLES = ("movies", "ratings", "downloads", "referrals", "download_buckets")
+# a table walked without an index, SQLite shows index walks as SCAN ... USING
+FULL_SCAN = re.compile(r"^SCAN (%s)$" % "|".join(TABLES))
+
+
+def test_every_crud_query_uses_an_index(db):
+    movies = crud.upsert_movies(
+        db,
+        [
+            models.Movie(
+                name=f"Hello {i}",
+                engine="netnaija",
+                date_created=datetime.datetime(2020, 1, 1),
+            )
+            for i in range(3)
+        ],
+    )
+    referral_id = movies[0].referral_id
+    movie = schemas.MovieRating(referral_id=referral_id)
+
+    calls = [
+        lambda: crud.create_or_update_rating(
+            db,
+            schemas.SpecificRatingScore(
+                ip_address="1", referral_id=referral_id, score="4"
+            ),
+        ),
+        lambda: crud.create_download(
+            db, schemas.DownloadCreate(ip_address="1", referral_id=referral_id)
+        ),
+        lambda: crud.create_referral(
+            db, schemas.ReferralCreate(ip_address="1", referral_id=referral_id)
+        ),
+        lambda: crud.list_movies(db, "netnaija", 1, 2),
+        lambda: crud.list_movies(db, "netnaija", 1, 2, after=page.after),
+        lambda: crud.search_movies(db, "netnaija", "hello", 1, 2),
+        lambda: crud.get_movie_by_referral_id(db, referral_id),
+        lambda: crud.get_movie_ratings(db, movie),
+        lambda: crud.get_movie_average_ratings(db, movie),
+        lambda: crud.get_rating(
+            db, schemas.SpecificRating(ip_address="1", referral_id=referral_id)
+        ),
+        lambda: crud.get_number_of_downloads(db, movie),
+        lambda: crud.get_no_of_referrals(db, movie),
+        lambda: crud.get_highest_downloads(
+            db, schemas.DownloadFilter(filter_by="days", filter_num=1, top=2)
+        ),
+        lambda: crud.get_movies_stats(
+            db, schemas.MovieBatch(referral_ids=[referral_id])
+        ),
+    ]
+    page = crud.list_movies(db, "netnaija", 1, 2)
+    # cached results issue no statements and would pass unchecked
+    cache.clear_all()
+
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append((statement, parameters))
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    silent = []
+    try:
+        for number, call in enumerate(calls):
+            issued = len(executed)
+            call()
+            if len(executed) == issued:
+                silent.append(number)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert silent == []
+
+    full_scans = {}
+    for statement, parameters in executed:
+        if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            continue
+        plan = db.connection().exec_driver_sql(
+            "EXPLAIN QUERY PLAN " + statement, parameters
+        )
+        scans = [row[3] for row in plan if FULL_SCAN.match(row[3])]
+        if scans:
+            full_scans[statement] = scans
+    assert full_scans == {}
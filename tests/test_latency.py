@@ -0,0 +1,89 @@
+import asyncio
+
+import httpx
+
+from app import latency, metrics, utils
+from app.settings import settings
+
+
+def test_timeout_follows_the_engines_p99_within_bounds(monkeypatch):
+    monkeypatch.setattr(settings, "gophie_latency_min_samples", 10)
+    monkeypatch.setattr(settings, "gophie_timeouts", {"animeout": 3})
+    monkeypatch.setattr(latency, "_trackers", {})
+
+    assert latency.timeout("fzmovies") == settings.gophie_timeout
+    for sample in range(1, 101):
+        latency.tracker("fzmovies").record(sample / 100)
+        latency.tracker("animeout").record(sample / 10)
+        latency.tracker("netnaija").record(0.01)
+
+    assert latency.timeout("fzmovies") == 0.99 * settings.gophie_timeout_multiplier
+    # capped by the engine's timeout and floored by the minimum
+    assert latency.timeout("animeout") == 3
+    assert latency.timeout("netnaija") == settings.gophie_min_timeout
+    assert latency.hedge_delay("fzmovies") is None
+
+
+def test_hedged_request_takes_the_first_response(monkeypatch):
+    monkeypatch.setattr(settings, "gophie_latency_min_samples", 1)
+    monkeypatch.setattr(settings, "gophie_hedges", {"netnaija": True})
+    monkeypatch.setattr(settings, "gophie_engine_concurrency", 2)
+    monkeypatch.setattr(latency, "_trackers", {})
+    monkeypatch.setattr(utils, "_engine_semaphores", {})
+    latency.tracker("netnaija").record(0.01)
+    attempts = []
+
+    async def handler(request):
+        attempts.append(request)
+        if len(attempts) == 1:
+            await asyncio.sleep(1)
+            return httpx.Response(200, json=["slow"])
+        return httpx.Response(200, json=["hedged"])
+
+    async def fetch():
+        monkeypatch.setattr(
+            utils,
+            "_gophie_client",
+            httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+        response = await utils.get_from_gophie("http://gophie/list", {}, "netnaija")
+        # the hedge's permit is given back
+        await asyncio.sleep(0)
+        assert utils.get_engine_semaphore("netnaija")._value == 2
+        return response
+
+    hedges = metrics.gophie_hedges._values.get(("netnaija",), 0)
+    assert asyncio.run(fetch()).json() == ["hedged"]
+    assert len(attempts) == 2
+    assert metrics.gophie_hedges._values[("netnaija",)] == hedges + 1
+
+
+def test_hedge_is_skipped_without_a_free_permit(monkeypatch):
+    monkeypatch.setattr(settings, "gophie_latency_min_samples", 1)
+    monkeypatch.setattr(settings, "gophie_hedges", {"netnaija": True})
+    monkeypatch.setattr(settings, "gophie_engine_concurrency", 1)
+    monkeypatch.setattr(latency, "_trackers", {})
+    monkeypatch.setattr(utils, "_engine_semaphores", {})
+    latency.tracker("netnaija").record(0.01)
+    attempts = []
+
+    async def handler(request):
+        attempts.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json=["slow"])
+
+    async def fetch():
+        monkeypatch.setattr(
+            utils,
+            "_gophie_client",
+            httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+        # the only permit is held by the first request, as fetch does
+        async with utils.get_engine_semaphore("netnaija"):
+            response = await utils.get_from_gophie("http://gophie/list", {}, "netnaija")
+        return response, utils.get_engine_semaphore("netnaija").locked()
+
+    response, locked = asyncio.run(fetch())
+    assert response.json() == ["slow"]
+    assert len(attempts) == 1
+    assert not locked
@@ -0,0 +1,70 @@
+import httpx
+
+from app import metrics, utils
+from app.models import crud, models
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram(
+        "test_seconds", "Test histogram", labels=("route",), buckets=(0.1, 1)
+    )
+    metrics._metrics.remove(histogram)
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, route='/a"b')
+
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{route="/a\\"b",le="0.1"} 2',
+        'test_seconds_bucket{route="/a\\"b",le="1"} 3',
+        'test_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{route="/a\\"b"} 5.65',
+        'test_seconds_count{route="/a\\"b"} 4',
+    ]
+
+
+def samples(client):
+    """Every sample of the /metrics response by name and labels"""
+    lines = client.get("/metrics").text.splitlines()
+    return {
+        name: float(value)
+        for name, value in (
+            line.rsplit(" ", 1) for line in lines if not line.startswith("#")
+        )
+    }
+
+
+def increase(before, after, name):
+    """How much a sample grew, the metrics are shared by every test"""
+    return after[name] - before.get(name, 0)
+
+
+def test_metrics_record_route_latency_queries_and_caches(client, db, statements):
+    movie = crud.upsert_movies(db, [models.Movie(name="a", engine="netnaija")])[0]
+    before = samples(client)
+    del statements[:]
+    client.post("/movie/downloads/", json={"referral_id": movie.referral_id})
+    client.get("/no/such/path")
+
+    after = samples(client)
+    downloads = 'method="POST",route="/movie/downloads/"'
+    name = f'ocena_http_request_duration_seconds_count{{{downloads},status="200"}}'
+    assert increase(before, after, name) == 1
+    name = 'ocena_http_request_duration_seconds_count{method="GET",route="unmatched",'
+    assert increase(before, after, name + 'status="404"}') == 1
+    # the saved movie is resolved in process, only the count is queried
+    assert len(statements) == 1
+    name = f"ocena_http_request_db_queries_sum{{{downloads}}}"
+    assert increase(before, after, name) == 1
+    assert 'ocena_cache_misses_total{cache="referral_ids"}' in after
+
+
+def test_gophie_latency_is_recorded_by_engine_and_status(client, monkeypatch):
+    transport = httpx.MockTransport(lambda request: httpx.Response(502))
+    monkeypatch.setattr(
+        utils, "_gophie_client", httpx.AsyncClient(transport=transport)
+    )
+    before = samples(client)
+
+    client.get("/list/", params={"engine": "FzMovies"})
+
+    name = 'ocena_gophie_request_duration_seconds_count{engine="fzmovies",status="502"}'
+    assert increase(before, samples(client), name) == 1
@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from app.models import pool
+from app.settings import settings
+
+
+def test_pool_stats_record_checkouts_timeouts_and_lifetimes(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "db_pool_size", 1)
+    monkeypatch.setattr(settings, "db_max_overflow", 1)
+    monkeypatch.setattr(settings, "db_pool_timeout", 0.01)
+    monkeypatch.setattr(pool, "_stats", {})
+    url = f"sqlite:///{tmp_path}/pool.sqlite3"
+    engine = create_engine(url, **pool.pool_options("test", url))
+    pool.instrument(engine, "test")
+
+    first, second = engine.connect(), engine.connect()
+    stats = pool.stats()["test"]
+    assert (stats["in_use"], stats["overflow"], stats["checkouts"]) == (2, 1, 2)
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    first.close()
+    second.close()
+    engine.dispose()
+
+    stats = pool.stats()["test"]
+    assert stats["timeouts"] == 1
+    assert (stats["in_use"], stats["max_in_use"], stats["max_overflow"]) == (0, 2, 1)
+    # the overflow connection is closed on checkin, the other on dispose
+    assert stats["opened"] == stats["closed"] == 2
+    assert stats["max_lifetime_seconds"] > 0
+
+
+@pytest.mark.parametrize(
+    "url", ["sqlite://", "sqlite:///:memory:", "sqlite:///file:db?mode=memory&uri=true"]
+)
+def test_in_memory_sqlite_shares_one_connection(url, monkeypatch):
+    monkeypatch.setattr(pool, "_stats", {})
+    engine = create_engine(url, **pool.pool_options("test", url))
+    pool.instrument(engine, "test")
+    with engine.connect() as connection:
+        connection.exec_driver_sql("CREATE TABLE t (id INTEGER)")
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT COUNT(*) FROM t").scalar() == 0
+    assert pool.stats()["test"]["pool"] == "StaticPool"
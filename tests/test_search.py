@@ -0,0 +1,73 @@
+import os
+import importlib.util
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from app import search
+from app.settings import BASE_DIR
+from app.models import crud, models
+
+# the migration that adds the search indexes
+SEARCH_MIGRATION = os.path.join(
+    BASE_DIR,
+    "alembic",
+    "versions",
+    "7c1e9b3d5a20_eighth_revision_add_movie_name_search_indexes.py",
+)
+
+
+@pytest.fixture
+def fts5(db):
+    """The database with the FTS5 index of the search migration"""
+    spec = importlib.util.spec_from_file_location("search_migration", SEARCH_MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    context = MigrationContext.configure(db.connection())
+    with Operations.context(context):
+        migration.upgrade()
+
+
+def add_movies(db, *names, engine="netnaija"):
+    crud.upsert_movies(
+        db, [models.Movie(name=name, engine=engine) for name in names]
+    )
+
+
+def test_fts5_search_matches_substrings_and_keeps_in_sync(db, fts5):
+    add_movies(db, "Hello Kitty", "Say Hello", "Goodbye")
+    add_movies(db, "Hello Other Engine", engine="fzmovies")
+    assert search.detect_backend(db) is search.backends["fts5"]
+
+    movies = search.backends["fts5"].search(db, "NetNaija", "hello", 1, 20)
+    assert sorted(movie.name for _, movie in movies) == ["Hello Kitty", "Say Hello"]
+    # short queries fall back to LIKE
+    movies = search.backends["fts5"].search(db, "netnaija", "db", 1, 20)
+    assert [movie.name for _, movie in movies] == ["Goodbye"]
+
+
+def test_like_search_is_detected_without_an_index(db):
+    add_movies(db, "Hello Kitty", "Goodbye")
+    assert search.detect_backend(db) is search.backends["like"]
+    movies = search.backends["like"].search(db, "netnaija", "KITTY", 1, 20)
+    assert [movie.name for _, movie in movies] == ["Hello Kitty"]
+
+
+def test_fts5_search_pages_after_rank_keyset(db, fts5):
+    add_movies(db, *(f"Hello {i}" for i in range(5)))
+    backend = search.backends["fts5"]
+
+    ranked = backend.search(db, "netnaija", "hello", 1, 2)
+    pages = [movie.name for _, movie in ranked]
+    while len(ranked) == 2:
+        rank, movie = ranked[-1]
+        ranked = backend.search(db, "netnaija", "hello", 1, 2, [rank, movie.id])
+        pages += [movie.name for _, movie in ranked]
+    offset_pages = [
+        movie.name
+        for page in (1, 2, 3)
+        for _, movie in backend.search(db, "netnaija", "hello", page, 2)
+    ]
+    assert pages == offset_pages
+    assert sorted(pages) == [f"Hello {i}" for i in range(5)]
@@ -0,0 +1,60 @@
+import datetime
+
+from app import cache, trending
+from app.models import crud, models, schemas
+
+
+def test_space_saving_keeps_capacity_counters():
+    summary = trending.SpaceSaving(capacity=2)
+    for key in "aaabbc":
+        summary.add(key)
+    assert len(summary.counts) == 2
+    assert summary.counts["a"] == 3
+    # c replaced b and inherited its count
+    assert summary.counts["c"] == 3
+
+
+def test_top_only_counts_buckets_in_window():
+    downloads = trending.TrendingDownloads(
+        retention_hours=48, capacity=16, refresh_seconds=0
+    )
+    downloads.ready = True
+    now = datetime.datetime.utcnow()
+    downloads.record(1, now, count=2)
+    downloads.record(2, now)
+    downloads.record(2, now - datetime.timedelta(hours=5), count=5)
+    assert downloads.top(datetime.timedelta(hours=1), 2) == [(1, 2), (2, 1)]
+    assert downloads.top(datetime.timedelta(hours=6), 1) == [(2, 6)]
+    assert not downloads.covers(datetime.timedelta(days=7))
+
+
+def test_load_reads_download_buckets(db):
+    (movie,) = crud.upsert_movies(db, [models.Movie(name="a", engine="netnaija")])
+    now = datetime.datetime.utcnow()
+    crud.increment_download_buckets(db, {(movie.id, now): 4})
+    db.commit()
+    downloads = trending.TrendingDownloads(
+        retention_hours=48, capacity=16, refresh_seconds=0
+    )
+    downloads.load(db)
+    assert downloads.top(datetime.timedelta(hours=1), 5) == [(movie.id, 4)]
+
+
+def test_highest_downloads_uses_loaded_trending_counters(db, monkeypatch):
+    a, b = crud.upsert_movies(
+        db, [models.Movie(name=name, engine="x") for name in "ab"]
+    )
+    downloads = trending.TrendingDownloads(
+        retention_hours=48, capacity=16, refresh_seconds=0
+    )
+    downloads.load(db)
+    monkeypatch.setattr(trending, "downloads", downloads)
+    for movie in (a, b, b):
+        crud.create_download(
+            db, schemas.DownloadCreate(ip_address="1", referral_id=movie.referral_id)
+        )
+    cache.clear_all()
+    highest = crud.get_highest_downloads(
+        db, schemas.DownloadFilter(filter_by="hours", filter_num=2, top=5)
+    )
+    assert [(movie.name, movie.downloads) for movie in highest] == [("b", 2), ("a", 1)]
@@ -0,0 +1,71 @@
+import asyncio
+
+import httpx
+
+from main import app
+from app import circuit, latency, utils
+from app.settings import settings
+
+
+def test_gophie_client_is_shared_until_closed(monkeypatch):
+    monkeypatch.setattr(utils, "_gophie_client", None)
+
+    async def run():
+        client = utils.get_gophie_client()
+        assert utils.get_gophie_client() is client
+        await utils.close_gophie_client()
+        assert client.is_closed
+        # a later request opens a fresh client
+        reopened = utils.get_gophie_client()
+        assert reopened is not client
+        await utils.close_gophie_client()
+
+    asyncio.run(run())
+
+
+def test_shutdown_closes_the_gophie_client(monkeypatch):
+    monkeypatch.setattr(utils, "_gophie_client", None)
+
+    async def run():
+        client = utils.get_gophie_client()
+        await app.router.shutdown()
+        assert client.is_closed
+        assert utils._gophie_client is None
+
+    asyncio.run(run())
+
+
+def test_engine_concurrency_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, "gophie_engine_concurrency", 2)
+    monkeypatch.setattr(utils, "_engine_semaphores", {})
+    circuit.reset()
+    latency.reset()
+    running, peak = 0, 0
+
+    async def handler(request):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return httpx.Response(200, json=[{"title": "Movie"}])
+
+    async def fetch():
+        monkeypatch.setattr(
+            utils,
+            "_gophie_client",
+            httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+        await asyncio.gather(
+            *(
+                utils.fetch_movies_from_remote("http://gophie/list", {}, "netnaija")
+                for _ in range(6)
+            )
+        )
+        # other engines have their own permits
+        assert utils.get_engine_semaphore("fzmovies") is not (
+            utils.get_engine_semaphore("netnaija")
+        )
+
+    asyncio.run(fetch())
+    assert peak == 2
@@ -0,0 +1,72 @@
+import time
+import asyncio
+
+from sqlalchemy.orm import sessionmaker
+
+from app import cache, writebehind
+from app.models import crud, models, schemas
+
+
+def test_buffered_downloads_and_referrals_are_flushed_on_stop(db, monkeypatch):
+    monkeypatch.setattr(writebehind, "SessionLocal", sessionmaker(bind=db.get_bind()))
+    buffer = writebehind.WriteBehindBuffer(
+        max_events=100, batch_size=10, flush_interval=60, put_timeout=0
+    )
+    monkeypatch.setattr(writebehind, "buffer", buffer)
+    monkeypatch.setattr(crud.settings, "write_behind_enabled", True)
+    (movie,) = crud.upsert_movies(db, [models.Movie(name="a", engine="netnaija")])
+    fired = []
+    for event in ("download_created", "referral_created"):
+        hooks = list(cache._hooks[event])
+        hooks.append(lambda event=event, **_: fired.append(event))
+        monkeypatch.setitem(cache._hooks, event, hooks)
+
+    # not running yet, so the download is written synchronously
+    assert crud.create_download(
+        db, schemas.DownloadCreate(ip_address="1", referral_id=movie.referral_id)
+    ).id
+    buffer.start()
+    for _ in range(3):
+        queued = crud.create_download(
+            db, schemas.DownloadCreate(ip_address="1", referral_id=movie.referral_id)
+        )
+        assert queued.id is None
+    crud.create_referral(
+        db, schemas.ReferralCreate(ip_address="1", referral_id=movie.referral_id)
+    )
+    # the events are fired once the rows are written
+    assert fired == ["download_created"]
+    buffer.stop()
+    assert fired.count("download_created") == 4
+    assert fired.count("referral_created") == 1
+
+    assert buffer.stats()["flushed"] == 4
+    assert buffer.stats()["queue_depth"] == 0
+    assert db.query(models.Download).count() == 4
+    assert db.query(models.Referral).count() == 1
+    (bucket,) = db.query(models.DownloadBucket).all()
+    assert bucket.count == 4
+
+
+def test_put_rejects_when_queue_is_full():
+    buffer = writebehind.WriteBehindBuffer(
+        max_events=1, batch_size=10, flush_interval=60, put_timeout=0.01
+    )
+    buffer._thread = type("Thread", (), {"is_alive": lambda self: True})()
+    assert buffer.put("downloads", {})
+    assert not buffer.put("downloads", {})
+    assert buffer.stats()["rejected"] == 1
+
+
+def test_put_does_not_wait_on_the_event_loop():
+    buffer = writebehind.WriteBehindBuffer(
+        max_events=1, batch_size=10, flush_interval=60, put_timeout=5
+    )
+    buffer._thread = type("Thread", (), {"is_alive": lambda self: True})()
+
+    async def put_twice():
+        return buffer.put("downloads", {}), buffer.put("downloads", {})
+
+    start = time.monotonic()
+    assert asyncio.run(put_twice()) == (True, False)
+    assert time.monotonic() - start < 1